@@ -1,17 +1,13 @@
 import asyncio
 from logging.config import fileConfig
-import sys
-import os
 
 from sqlalchemy import pool
 from sqlalchemy.ext.asyncio import async_engine_from_config
 
 from alembic import context
 
-from models import Base
 # ----------------------------------------------------------------------
-# 👇 1. Добавляем путь к корню проекта, чтобы Python увидел 'config.py'
-sys.path.append(os.path.join(sys.path[0], '..'))
+# 👇 1. Корень проекта уже в sys.path: об этом заботится prepend_sys_path = . в alembic.ini
 
 # 👇 2. Импортируем наши настройки
 from config import settings
@@ -23,9 +19,11 @@ config = context.config
 
 # ----------------------------------------------------------------------
 # 👇 3. ПОДМЕНЯЕМ URL базы данных на тот, что в config.py
-# Alembic работает через SQLAlchemy, ему нужен формат postgresql+asyncpg
-db_url = f"postgresql+asyncpg://{settings.DB_USER}:{settings.DB_PASSWORD}@{settings.DB_HOST}:{settings.DB_PORT}/{settings.DB_NAME}"
-config.set_main_option("sqlalchemy.url", db_url)
+# Alembic работает через SQLAlchemy, ему нужен формат postgresql+asyncpg.
+# Берем готовую сборку из settings: она учитывает и DATABASE_URL (Render), и отдельные поля DB_*,
+# так что миграции и приложение всегда смотрят в одну и ту же базу.
+# % в пароле нужно экранировать: set_main_option проходит через интерполяцию ConfigParser
+config.set_main_option("sqlalchemy.url", settings.get_database_url.replace("%", "%%"))
 # ----------------------------------------------------------------------
 
 # Interpret the config file for Python logging.
@@ -37,7 +35,23 @@ if config.config_file_name is not None:
 # for 'autogenerate' support
 # from myapp import mymodel
 # target_metadata = mymodel.Base.metadata
-target_metadata = Base.metadata
+def load_target_metadata():
+    """
+    Метаданные моделей нужны только для сравнения схемы (revision --autogenerate и check).
+    Обычный upgrade/downgrade при старте контейнера выполняет готовые миграции,
+    поэтому модели SQLAlchemy там не импортируем.
+    """
+    cmd_opts = config.cmd_opts
+    if cmd_opts is None:
+        return None
+    command_name = getattr(cmd_opts, 'cmd', (None,))[0]
+    if getattr(cmd_opts, 'autogenerate', False) or getattr(command_name, '__name__', '') == 'check':
+        from models import Base
+        return Base.metadata
+    return None
+
+
+target_metadata = load_target_metadata()
 
 # ... остальные настройки ...
 
@@ -68,6 +82,8 @@ async def run_migrations_online() -> None:
     connectable = async_engine_from_config(
         config.get_section(config.config_ini_section),
         prefix="sqlalchemy.",
+        # NullPool здесь уместен: все миграции идут через одно соединение (connect() ниже),
+        # и переиспользовать в рамках одного запуска alembic нечего.
         poolclass=pool.NullPool,
     )
 
@@ -0,0 +1,30 @@
+"""add_users_username_hash_index
+
+Revision ID: 24b20c11bb53
+Revises: 2dde86254ea8
+Create Date: 2026-10-16 10:10:12.418305
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '24b20c11bb53'
+down_revision: Union[str, None] = '2dde86254ea8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Аутентификация ищет пользователя только по равенству username = $1,
+    # а для равенства hash-индекс компактнее и быстрее btree на строках.
+    # Уникальный btree-индекс остается: на нем держатся UNIQUE, ON CONFLICT и внешние ключи.
+    op.create_index('ix_users_username_hash', 'users', ['username'], unique=False, postgresql_using='hash')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_users_username_hash', table_name='users', postgresql_using='hash')
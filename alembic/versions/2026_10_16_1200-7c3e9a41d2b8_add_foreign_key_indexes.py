@@ -0,0 +1,32 @@
+"""add_foreign_key_indexes
+
+Revision ID: 7c3e9a41d2b8
+Revises: 24b20c11bb53
+Create Date: 2026-10-16 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c3e9a41d2b8'
+down_revision: Union[str, None] = '24b20c11bb53'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Postgres индексирует только ссылаемую сторону внешнего ключа (users.username).
+    # Товары пользователя выбираются по owner_username, расчеты относятся к username —
+    # без индексов эти выборки и проверки FK при изменении users идут полным сканом.
+    op.create_index(op.f('ix_products_owner_username'), 'products', ['owner_username'], unique=False)
+    op.create_index(op.f('ix_calculations_username'), 'calculations', ['username'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_calculations_username'), table_name='calculations')
+    op.drop_index(op.f('ix_products_owner_username'), table_name='products')
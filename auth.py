@@ -1,26 +1,117 @@
 # auth.py
-from datetime import datetime, timedelta, UTC
 import os
+import time
+import asyncio
+import hmac
+import hashlib
+import base64
+import binascii
+import uuid
+import logging
 import asyncpg
-from jose import jwt, JWTError
-from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status, APIRouter
+import bcrypt
+import orjson
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+from cachetools import TTLCache, TLRUCache
+from jwt import InvalidTokenError, ExpiredSignatureError
+from fastapi import Depends, HTTPException, status, APIRouter, BackgroundTasks
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials, OAuth2PasswordRequestForm
-from database import get_pool # Импортируем нашу зависимость для пула БД
+from database import get_pool, get_redis # Импортируем наши зависимости для пула БД и Redis
 from pydantic import BaseModel, Field
 from typing import Optional
 from s3_service import s3_client
 
 
 # --- 1. Настройки и объекты ---
+# Логгер вместо print: на уровне INFO и выше debug-сообщения даже не форматируются
+logger = logging.getLogger(__name__)
+
 # Загружаем переменные из .env, предоставляя значения по умолчанию для безопасности
 SECRET_KEY = os.getenv('SECRET_KEY', 'a_very_secret_key_for_local_development')
+# HS256 оставляем сознательно: проверка HMAC-SHA256 через OpenSSL (с аппаратным SHA, где он есть)
+# занимает единицы микросекунд, а проверка подписи Ed25519 — десятки. Токены выпускает и проверяет
+# один и тот же сервис, так что асимметричные ключи здесь ничего не дают.
 ALGORITHM = 'HS256'
+# Ключ в байтах и список алгоритмов готовим один раз, а не на каждый encode/decode
+SECRET_KEY_BYTES = SECRET_KEY.encode()
+ALGORITHMS = (ALGORITHM,)
+# Новые пароли хешируем Argon2id (argon2-cffi) — его OWASP рекомендует первым: он требует памяти,
+# поэтому перебор на GPU обходится дорого. Параметры фиксируем явно, а не полагаемся на дефолт библиотеки.
+# По умолчанию — базовый профиль OWASP: 46 МиБ памяти, 1 проход, 1 поток (~50-80 мс на хеш).
+# Память берется на каждый одновременный хеш, так что поток логинов стоит и памяти, и CPU.
+# Старые bcrypt-хеши по-прежнему проверяются и пересчитываются в Argon2id при следующем входе
+# (password_needs_rehash), как и хеши с параметрами, отличными от текущих.
+ARGON2_TIME_COST = int(os.getenv('ARGON2_TIME_COST', '1'))
+ARGON2_MEMORY_COST_KIB = int(os.getenv('ARGON2_MEMORY_COST_KIB', str(46 * 1024)))
+ARGON2_PARALLELISM = 1
+ARGON2_PREFIX = '$argon2'
+BCRYPT_PREFIXES = ('$2a$', '$2b$', '$2y$')
+# Если один хеш на этой машине считается дольше, предупреждаем при старте
+PASSWORD_HASH_SLOW_THRESHOLD_MS = 500
+
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 REFRESH_TOKEN_EXPIRE_DAYS = 7
+# Время жизни токенов в секундах: exp считаем целым epoch-временем, без datetime/timedelta
+ACCESS_TTL = ACCESS_TOKEN_EXPIRE_MINUTES * 60
+REFRESH_TTL = REFRESH_TOKEN_EXPIRE_DAYS * 86400
+
+# SQL-запросы держим константами: asyncpg кэширует подготовленные выражения по тексту запроса
+# (statement_cache_size в database.py), поэтому один и тот же текст разбирается сервером
+# только один раз на соединение, а дальше выполняется уже готовый план.
+SELECT_USER_SQL = 'SELECT username, hashed_password, avatar_url FROM users WHERE username = $1'
+# Для проверки токена хеш пароля не нужен — не гоняем лишние 60 байт на каждый запрос
+SELECT_USER_PROFILE_SQL = 'SELECT username, avatar_url FROM users WHERE username = $1'
+INSERT_USER_SQL = (
+    'INSERT INTO users (username, hashed_password) VALUES ($1, $2) '
+    'ON CONFLICT (username) DO NOTHING RETURNING username'
+)
+UPDATE_PASSWORD_SQL = 'UPDATE users SET hashed_password = $1 WHERE username = $2'
+
+# Отозванные токены храним в Redis ключами revoked:<jti> со сроком жизни до exp токена:
+# проверка — один EXISTS без похода в Postgres, а истекшие записи Redis удаляет сам
+REVOKED_KEY_PREFIX = 'revoked:'
+# Выданные refresh токены: refresh:<username>:<jti> -> sha256 токена, со сроком жизни до exp.
+# Запись в Redis (SETEX) вместо строки в Postgres: один быстрый round-trip при логине,
+# а истекшие записи не нужно чистить по расписанию — Redis удаляет их сам.
+REFRESH_KEY_PREFIX = 'refresh:'
+# Второй уровень кэша профилей — общий для всех процессов: user:<username> -> JSON профиля.
+# Хеш пароля сюда не попадает, только то, что отдает SELECT_USER_PROFILE_SQL.
+USER_KEY_PREFIX = 'user:'
+USER_REDIS_TTL = 300
 
 # Создаем объекты один раз при загрузке модуля
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Кэш успешных проверок паролей. Хеш пароля специально медленный (десятки миллисекунд на вызов),
+# поэтому повторные логины того же пользователя за 30 секунд берем из памяти.
+# Неудачные проверки не кэшируем: поток неверных паролей не должен вытеснять отсюда
+# записи настоящих пользователей, а подбор пароля пусть платит полную цену хеширования.
+_verify_cache: TTLCache = TTLCache(maxsize=4096, ttl=30)
+# Проверки, которые сейчас считаются в потоке: одновременные логины с одной парой
+# (пароль, хеш) ждут одну и ту же задачу, а не запускают проверку заново
+_verify_inflight: dict[bytes, asyncio.Task] = {}
+# Хешер Argon2id (тип по умолчанию в argon2-cffi) создаем один раз
+_password_hasher = PasswordHasher(
+    time_cost=ARGON2_TIME_COST,
+    memory_cost=ARGON2_MEMORY_COST_KIB,
+    parallelism=ARGON2_PARALLELISM,
+)
+# Кэш аутентификации: sha256(токен) -> (данные пользователя, exp токена, jti токена).
+# SPA за одну загрузку страницы дергает несколько защищенных ручек с одним и тем же токеном,
+# и без кэша каждая из них делает одинаковый SELECT в users.
+# Сами токены в памяти не храним — только их хеш. Запись живет AUTH_CACHE_TTL секунд,
+# но не дольше exp токена, так что истекший токен из кэша не достать.
+AUTH_CACHE_TTL = 60
+
+def _auth_cache_expires(_key: bytes, entry: tuple, now: float) -> float:
+    return min(now + AUTH_CACHE_TTL, entry[1])
+
+# timer=time.time: exp в токене — epoch-время, сравниваем с ним же
+_auth_cache: TLRUCache = TLRUCache(maxsize=10_000, ttu=_auth_cache_expires, timer=time.time)
+# Разбор токенов, которые сейчас идут в БД: параллельные запросы с одним токеном ждут один SELECT
+_auth_inflight: dict[bytes, asyncio.Task] = {}
+# Кэш профилей: username -> профиль. Нужен, когда у пользователя новый токен (после логина,
+# с другого устройства): кэш по токену еще пуст, а профиль уже есть и в БД за ним не ходим.
+_user_cache: TTLCache = TTLCache(maxsize=5000, ttl=30)
 # ИСПРАВЛЕНО: Создаем простой security-объект. Он создаст правильную кнопку "Authorize".
 security = HTTPBearer()
 
@@ -40,83 +131,410 @@ class UserCreate(BaseModel):
     username: str
     password: str = Field(..., max_length=72)
 
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
 class UserOut(BaseModel):
     username: str
     avatar_url: Optional[str] = None
 
-# --- 3. Утилиты (без изменений) ---
-def verify_password(plain_password: str, hashed_password: str) -> bool:
+# --- 3. Утилиты: хеширование и проверка паролей ---
+def _verify_cache_key(plain_password: str, hashed_password: str) -> bytes:
+    """Ключ кэша: HMAC от пары (пароль, хеш), чтобы не хранить пароль в открытом виде."""
+    message = plain_password.encode() + b'|' + hashed_password.encode()
+    return hmac.new(SECRET_KEY_BYTES, message, hashlib.sha256).digest()
+
+# Работаем с argon2-cffi и bcrypt напрямую, без passlib: схем у нас две, и различить их
+# по префиксу хеша дешевле, чем диспетчеризация passlib на каждом вызове.
+def _hash_password(password: str) -> str:
+    return _password_hasher.hash(password)
+
+def _check_password(plain_password: str, hashed_password: str) -> bool:
+    if hashed_password.startswith(ARGON2_PREFIX):
+        try:
+            return _password_hasher.verify(hashed_password, plain_password)
+        except (VerificationError, InvalidHashError):
+            # Неверный пароль (VerifyMismatchError) или поврежденный хеш
+            return False
+    # Старый bcrypt-хеш: проверяем как раньше, при входе он будет пересчитан в Argon2id
+    try:
+        return bcrypt.checkpw(plain_password.encode(), hashed_password.encode())
+    except ValueError:
+        # В базе лежит строка, которая не является ни Argon2-, ни bcrypt-хешем
+        return False
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    """True для bcrypt-хешей и для Argon2-хешей с параметрами, отличными от текущих."""
+    if hashed_password.startswith(ARGON2_PREFIX):
+        try:
+            return _password_hasher.check_needs_rehash(hashed_password)
+        except InvalidHashError:
+            return False
+    # Не хеш вовсе пересчитывать не пытаемся
+    return hashed_password.startswith(BCRYPT_PREFIXES)
+
+def benchmark_password_hash() -> float:
+    """Замеряет время одного хеша с текущими параметрами. Вызывается один раз при старте."""
+    start = time.perf_counter()
+    _hash_password('benchmark-password')
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    logger.info(
+        "argon2id: t=%s, m=%s МиБ, один хеш занимает %.0f мс",
+        _password_hasher.time_cost, _password_hasher.memory_cost // 1024, elapsed_ms,
+    )
+    if elapsed_ms > PASSWORD_HASH_SLOW_THRESHOLD_MS:
+        logger.warning(
+            "Хеш пароля медленнее %s мс: уменьшите ARGON2_TIME_COST или ARGON2_MEMORY_COST_KIB",
+            PASSWORD_HASH_SLOW_THRESHOLD_MS,
+        )
+    return elapsed_ms
+
+# argon2-cffi и bcrypt - C-расширения и отпускают GIL, поэтому уносим их в поток через asyncio.to_thread,
+# чтобы десятки миллисекунд хеширования не блокировали event loop для остальных запросов.
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Проверяет, соответствует ли обычный пароль хешированному."""
-    return pwd_context.verify(plain_password, hashed_password)
+    key = _verify_cache_key(plain_password, hashed_password)
+    if _verify_cache.get(key):
+        return True
+
+    task = _verify_inflight.get(key)
+    if task is None:
+        # Задача живет отдельно от запроса: если клиент, запустивший проверку, отключится,
+        # остальные ожидающие все равно получат результат. Убирает задачу из словаря она сама.
+        task = asyncio.ensure_future(asyncio.to_thread(_check_password, plain_password, hashed_password))
+        _verify_inflight[key] = task
+        task.add_done_callback(lambda done: _finish_verify(key, done))
+
+    # shield: отмена одного ожидающего не отменяет общую проверку
+    return await asyncio.shield(task)
 
-def get_password_hash(password: str) -> str:
+def _finish_verify(key: bytes, task: asyncio.Task) -> None:
+    """Снимает завершенную проверку из списка активных и кэширует успешный результат."""
+    if _verify_inflight.get(key) is task:
+        del _verify_inflight[key]
+    if task.cancelled() or task.exception() is not None:
+        return
+    if task.result():
+        _verify_cache[key] = True
+
+async def get_password_hash(password: str) -> str:
     """Хеширует пароль."""
-    return pwd_context.hash(password)
+    return await asyncio.to_thread(_hash_password, password)
 
 # --- Функции для создания токенов ---
+def _b64url(raw: bytes) -> bytes:
+    """base64url без паддинга '=', как требует JWT."""
+    return base64.urlsafe_b64encode(raw).rstrip(b'=')
+
+# Заголовок у всех наших токенов одинаковый — кодируем его один раз
+_JWT_HEADER_B64 = _b64url(b'{"alg":"HS256","typ":"JWT"}')
+
+def _encode_jwt(payload: dict) -> str:
+    """
+    Собирает HS256 JWT вручную: готовый заголовок + payload + HMAC-SHA256.
+    Без библиотеки на выпуске токена нет разбора ключа, поиска алгоритма и сериализации заголовка.
+    JSON собирает orjson (экранирование корректное, так что имя с кавычками не сломает токен).
+    """
+    payload_b64 = _b64url(orjson.dumps(payload))
+    signing_input = _JWT_HEADER_B64 + b'.' + payload_b64
+    signature = hmac.new(SECRET_KEY_BYTES, signing_input, hashlib.sha256).digest()
+    return (signing_input + b'.' + _b64url(signature)).decode()
+
 # ИСПРАВЛЕНО: Эта функция теперь синхронная, так как создание токенов - быстрая операция.
-# Она больше не лезет в БД и использует datetime-объекты напрямую, что решает ошибку "Signature has expired".
+# Она больше не лезет в БД, а exp считает от текущего epoch-времени в секундах (так его и хранит JWT).
 def create_tokens(data: dict) -> dict:
     """Создает новую пару access и refresh токенов."""
-    
+    return _new_token_pair(data)[0]
+
+def _new_token_pair(data: dict) -> tuple[dict, dict]:
+    """Создает пару токенов и возвращает ее вместе с payload refresh токена (для его сохранения)."""
+    # Токены отличаются только exp и type — общую часть payload и текущее время берем один раз
+    now = int(time.time())
+
+    # jti — уникальный id токена, по нему токен можно отозвать (см. /auth/logout)
+    refresh_jti = uuid.uuid4().hex
+
     # Создаем access token
-    to_encode_access = data.copy()
-    expire_access = datetime.now(UTC) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode_access.update({"exp": expire_access, "type": "access"})
-    access_token = jwt.encode(to_encode_access, SECRET_KEY, algorithm=ALGORITHM)
+    # sid — jti refresh токена из той же пары: по нему /auth/logout гасит и refresh токен
+    access_payload = {**data, "exp": now + ACCESS_TTL, "type": "access", "jti": uuid.uuid4().hex, "sid": refresh_jti}
+    access_token = _encode_jwt(access_payload)
 
     # Создаем refresh token
-    to_encode_refresh = data.copy()
-    expire_refresh = datetime.now(UTC) + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
-    to_encode_refresh.update({"exp": expire_refresh, "type": "refresh"})
-    refresh_token = jwt.encode(to_encode_refresh, SECRET_KEY, algorithm=ALGORITHM)
+    refresh_payload = {**data, "exp": now + REFRESH_TTL, "type": "refresh", "jti": refresh_jti}
+    refresh_token = _encode_jwt(refresh_payload)
     
-    return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
+    tokens = {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
+    return tokens, refresh_payload
+
+def _b64url_decode(segment: str) -> bytes:
+    """Обратное к _b64url: возвращаем отброшенный паддинг и декодируем."""
+    return base64.urlsafe_b64decode(segment + '=' * (-len(segment) % 4))
+
+_JWT_HEADER_SEGMENT = _JWT_HEADER_B64.decode()
+
+def _verified_payload(token: str) -> bytes:
+    """
+    Проверяет подпись и возвращает сырые байты payload, еще не разбирая JSON.
+    Сначала дешевые проверки формы и заголовка, затем один HMAC и сравнение за постоянное время —
+    мусорные и поддельные токены отсекаются до любого парсинга.
+    Результат не кэшируем: ключом кэша был бы сам токен (или его sha256, который стоит столько же,
+    сколько этот HMAC), а повторные запросы с тем же токеном и так закрывает _auth_cache.
+    """
+    header_b64, _, rest = token.partition('.')
+    payload_b64, _, signature_b64 = rest.partition('.')
+    # Заголовок у наших токенов всегда один и тот же — это заодно отсекает чужие алгоритмы и "none"
+    if header_b64 != _JWT_HEADER_SEGMENT or not payload_b64 or not signature_b64:
+        raise InvalidTokenError('Invalid token format')
+
+    expected = hmac.new(SECRET_KEY_BYTES, f'{header_b64}.{payload_b64}'.encode(), hashlib.sha256).digest()
+    try:
+        signature = _b64url_decode(signature_b64)
+        if not hmac.compare_digest(expected, signature):
+            raise InvalidTokenError('Signature verification failed')
+        return _b64url_decode(payload_b64)
+    except (binascii.Error, ValueError) as e:
+        raise InvalidTokenError('Invalid token encoding') from e
+
+def decode_token(token: str) -> dict:
+    """
+    Проверяет подпись токена и возвращает его payload.
+    Из claims нам нужен только exp — его проверяем сами на каждый вызов.
+    """
+    try:
+        payload = orjson.loads(_verified_payload(token))
+    except orjson.JSONDecodeError as e:
+        raise InvalidTokenError('Invalid payload') from e
+    if not isinstance(payload, dict):
+        raise InvalidTokenError('Invalid payload')
+
+    exp = payload.get('exp')
+    if not isinstance(exp, int) or exp <= time.time():
+        raise ExpiredSignatureError('Signature has expired')
+    return payload
 
 # --- НОВАЯ ФУНКЦИЯ-ПОМОЩНИК ---
 async def get_user_from_db(pool: asyncpg.Pool, username: str) -> dict | None:
-    """Получает пользователя из БД. Возвращает None в тестовом режиме."""
-    print(f"get_user_from_db вызван, pool={type(pool)}, username={username}")
+    """Получает пользователя из БД (None, если такого нет)."""
+    # Проверки пула на None нет: lifespan не даст серверу стартовать без базы,
+    # а тесты подкладывают фейковый пул в фикстуре db_pool
+    # pool.fetchrow сам берет и возвращает соединение — без лишнего async with
+    user = await pool.fetchrow(SELECT_USER_SQL, username)
+    return dict(user) if user else None
 
-    # КРИТИЧЕСКИ ВАЖНО: Проверка на None для тестового режима
-    if pool is None:
-        print("TESTING mode: returning None from get_user_from_db")
-        return None
 
-    async with pool.acquire() as conn:
-        user = await conn.fetchrow('SELECT username, hashed_password, avatar_url FROM users WHERE username = $1 ', username)
+async def get_user_profile(pool: asyncpg.Pool, username: str) -> dict | None:
+    """Получает профиль пользователя (без хеша пароля) для проверки токена."""
+    user = await pool.fetchrow(SELECT_USER_PROFILE_SQL, username)
     return dict(user) if user else None
 
 
+async def get_user_profile_cached(pool: asyncpg.Pool, username: str, redis=None) -> dict | None:
+    """
+    get_user_profile через два уровня кэша: память процесса (30 с), затем Redis (5 мин), затем БД.
+    Отсутствие пользователя не кэшируем: он может зарегистрироваться.
+    Redis здесь только ускоряет: если он недоступен, просто идем в БД.
+    """
+    user = _user_cache.get(username)
+    if user is not None:
+        return user
+
+    if redis is not None:
+        try:
+            cached = await redis.get(USER_KEY_PREFIX + username)
+            if cached is not None:
+                user = orjson.loads(cached)
+        except Exception as e:
+            logger.debug("Кэш профилей в Redis недоступен: %s", e)
+
+    if user is None:
+        user = await get_user_profile(pool, username)
+        if user is None:
+            return None
+        if redis is not None:
+            try:
+                await redis.set(USER_KEY_PREFIX + username, orjson.dumps(user), ex=USER_REDIS_TTL)
+            except Exception as e:
+                logger.debug("Кэш профилей в Redis недоступен: %s", e)
+
+    _user_cache[username] = user
+    return user
+
+
+async def rehash_password(pool: asyncpg.Pool, username: str, password: str, redis=None) -> None:
+    """
+    Сохраняет новый хеш пароля (Argon2id с текущими параметрами).
+    Запускается фоновой задачей после ответа на /login, поэтому ошибки не пробрасывает:
+    старый хеш остается рабочим, и пересчет просто повторится при следующем входе.
+    """
+    try:
+        new_hash = await get_password_hash(password)
+        await pool.execute(UPDATE_PASSWORD_SQL, new_hash, username)
+    except Exception as e:
+        logger.warning("Не удалось пересчитать хеш пароля для %s: %s", username, e)
+        return
+    await invalidate_user_cache(username, redis)
+
+
 # --- 4. Зависимость для получения текущего пользователя ---
 # Она напрямую запрашивает у FastAPI токен и пул соединений с БД.
 # ИСПРАВЛЕНО: Функция теперь зависит от HTTPBearer
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    pool: asyncpg.Pool = Depends(get_pool) #  1. Даем функции доступ к БД
+    pool: asyncpg.Pool = Depends(get_pool), #  1. Даем функции доступ к БД
+    redis = Depends(get_redis) # ... и к Redis, где лежит список отозванных токенов
 ) -> dict:
     
     credentials_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentioals")
 
     token = credentials.credentials # Извлекаем токен из объекта credentials
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        # Проверяем, что это именно access токен
-        if payload.get("type") != "access":
-            raise credentials_exception
-        username = payload.get('sub')
-        if username is None:
+    key = _token_key(token)
+
+    # 1. Сначала смотрим в кэш (истекшие по exp записи кэш уже не отдает)
+    result = _auth_cache.get(key)
+    if result is None:
+        # 2. Промах: разбираем токен и идем в БД одной задачей на токен
+        task = _auth_inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(_authenticate_token(token, pool, redis))
+            _auth_inflight[key] = task
+            task.add_done_callback(lambda done: _finish_authenticate(key, done))
+
+        result = await asyncio.shield(task)
+        if result is None:
             raise credentials_exception
-    except JWTError:
+
+    # 3. Отзыв проверяем на каждый запрос (и для закэшированных токенов тоже)
+    if await is_token_revoked(redis, result[2]):
         raise credentials_exception
 
-    # 👇 2. Идем в базу данных за ПОЛНЫМИ данными пользователя
-    user = await get_user_from_db(pool, username)
+    # Возвращаем копию профиля (username и avatar_url): эндпоинты, например /me, меняют словарь
+    return dict(result[0])
+
+
+async def _authenticate_token(token: str, pool: asyncpg.Pool, redis=None) -> tuple[dict, int, str | None] | None:
+    """Проверяет токен и загружает пользователя. Возвращает (пользователь, exp, jti) или None."""
+    # Отзыв здесь не проверяем: get_current_user делает это на каждый запрос, в том числе из кэша
+    try:
+        payload = _access_payload(token)
+    except InvalidTokenError:
+        return None
+    username = payload['sub']
+
+    # 👇 Идем в базу данных за профилем пользователя (хеш пароля здесь не нужен), если его нет в кэше
+    user = await get_user_profile_cached(pool, username, redis)
     if user is None:
-        raise credentials_exception
+        return None
+    return user, payload['exp'], payload.get('jti')
+
+
+def _token_key(token: str) -> bytes:
+    """Ключ кэша аутентификации: sha256 от токена, чтобы не держать сами токены в памяти."""
+    return hashlib.sha256(token.encode()).digest()
+
+
+def _finish_authenticate(key: bytes, task: asyncio.Task) -> None:
+    """Снимает завершенную задачу из списка активных и кэширует успешный результат."""
+    if _auth_inflight.get(key) is task:
+        del _auth_inflight[key]
+    if task.cancelled() or task.exception() is not None:
+        return
+    if task.result() is not None:
+        _auth_cache[key] = task.result()
+
+
+async def invalidate_user_cache(username: str, redis=None) -> None:
+    """Убирает из кэшей аутентификации профиль и все токены пользователя (после смены его данных)."""
+    _user_cache.pop(username, None)
+    stale = [key for key, entry in _auth_cache.items() if entry[0]['username'] == username]
+    for key in stale:
+        _auth_cache.pop(key, None)
+    if redis is not None:
+        await redis.delete(USER_KEY_PREFIX + username)
+
+
+async def is_token_revoked(redis, jti: str | None) -> bool:
+    """Проверяет, отозван ли токен. Без Redis (тесты) или без jti (старые токены) — не отозван."""
+    if redis is None or jti is None:
+        return False
+    return bool(await redis.exists(REVOKED_KEY_PREFIX + jti))
+
+
+def _access_payload(token: str) -> dict:
+    """decode_token + проверка, что это access токен с именем пользователя."""
+    payload = decode_token(token)
+    if payload.get('type') != 'access' or payload.get('sub') is None:
+        raise InvalidTokenError('Invalid token type')
+    return payload
+
+
+async def decode_access_token(token: str, redis=None) -> dict:
+    """
+    Полная проверка access токена для входов без get_current_user (WebSocket, GraphQL):
+    подпись, срок, тип и отзыв через /auth/logout. При любой проблеме — InvalidTokenError.
+    """
+    payload = _access_payload(token)
+    if await is_token_revoked(redis, payload.get('jti')):
+        raise InvalidTokenError('Token has been revoked')
+    return payload
+
+
+def _refresh_key(username: str, jti: str) -> str:
+    return f"{REFRESH_KEY_PREFIX}{username}:{jti}"
+
+
+async def issue_tokens(redis, username: str) -> dict:
+    """Создает пару токенов и запоминает refresh токен в Redis (в тестах без Redis — только создает)."""
+    tokens, refresh_payload = _new_token_pair({'sub': username})
+    if redis is not None:
+        digest = hashlib.sha256(tokens['refresh_token'].encode()).hexdigest()
+        await redis.setex(_refresh_key(username, refresh_payload['jti']), REFRESH_TTL, digest)
+    return tokens
 
-    # Возвращаем полный словарь (там теперь есть username, hashed_password и avatar_url)
-    return user
+
+async def consume_refresh_token(redis, token: str) -> str | None:
+    """
+    Проверяет refresh токен и гасит его (одноразовый: после обмена на новую пару не годится).
+    Возвращает имя пользователя или None. Без Redis (тесты) проверяется только подпись и срок.
+    """
+    try:
+        payload = decode_token(token)
+    except InvalidTokenError:
+        return None
+
+    username, jti = payload.get('sub'), payload.get('jti')
+    if payload.get('type') != 'refresh' or username is None or jti is None:
+        return None
+    if redis is None:
+        return username
+
+    # GETDEL атомарно: два параллельных обмена одного токена не получат две новые пары
+    stored = await redis.getdel(_refresh_key(username, jti))
+    if stored is None:
+        return None
+    if isinstance(stored, bytes):
+        stored = stored.decode()
+    digest = hashlib.sha256(token.encode()).hexdigest()
+    return username if hmac.compare_digest(stored, digest) else None
+
+
+async def revoke_token(redis, jti: str, exp: int) -> None:
+    """Помечает токен отозванным до момента, когда он истек бы сам."""
+    remaining = exp - int(time.time())
+    if redis is None or remaining <= 0:
+        return
+    await redis.set(REVOKED_KEY_PREFIX + jti, 1, ex=remaining)
+
+
+async def revoke_session(redis, payload: dict) -> None:
+    """
+    Выход по access токену: отзываем его и удаляем refresh токен той же пары (по sid),
+    чтобы после выхода через /auth/refresh нельзя было получить новую пару.
+    """
+    if payload.get('jti'):
+        await revoke_token(redis, payload['jti'], payload['exp'])
+    if redis is not None and payload.get('sid'):
+        await redis.delete(_refresh_key(payload['sub'], payload['sid']))
 
 
 # --- 5. НОВЫЙ БЛОК: Эндпоинты, перенесенные из main.py ---
@@ -126,41 +544,64 @@ async def get_current_user(
 # Затем выдаёт токены.
 @router.post('/register', response_model=Token)
 # user_in: UserCreate — объект, созданный из JSON-запроса (например, {"username": "alice", "password": "password123"}).
-async def register(user_in: UserCreate, pool: asyncpg.Pool = Depends(get_pool)):
+async def register(user_in: UserCreate, pool: asyncpg.Pool = Depends(get_pool), redis = Depends(get_redis)):
     try:
-        # Асинхронно проверяет наличие пользователя.
-        if await get_user_from_db(pool, user_in.username):
+        hashed_password = await get_password_hash(user_in.password)
+
+        # Одна команда вместо "SELECT есть ли такой?" + INSERT: при занятом имени
+        # ON CONFLICT ничего не вставит и RETURNING вернет пустой результат.
+        row = await pool.fetchrow(INSERT_USER_SQL, user_in.username, hashed_password)
+
+        if row is None:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Пользователь с таким именем уже существует')
-        
-        hashed_password = get_password_hash(user_in.password)
-
-        # Использует асинхронное соединение для записи.
-        async with pool.acquire() as conn:
-            await conn.execute(
-                'INSERT INTO users (username, hashed_password) VALUES ($1, $2)',
-                user_in.username, hashed_password
-            )
                 
-        return create_tokens(data={'sub': user_in.username})
-    except Exception as e:
-        print('Ошибка в register', e)
+        return await issue_tokens(redis, user_in.username)
+    except HTTPException:
+        # Занятое имя — обычный ответ клиенту, а не ошибка сервера
+        raise
+    except Exception:
+        logger.exception('Ошибка в register')
         raise
 
 
 # Эндпоинт для получения токена
 @router.post("/login", response_model=Token)
-async def login_for_token(form_data: OAuth2PasswordRequestForm = Depends(), pool: asyncpg.Pool = Depends(get_pool)):
+async def login_for_token(
+    background_tasks: BackgroundTasks,
+    form_data: OAuth2PasswordRequestForm = Depends(),
+    pool: asyncpg.Pool = Depends(get_pool),
+    redis = Depends(get_redis)
+):
     """Выдает access и refresh токены для пользователя."""
     user = await get_user_from_db(pool, form_data.username)
 
-    if not user or not verify_password(form_data.password, user["hashed_password"]):
+    if not user or not await verify_password(form_data.password, user["hashed_password"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Неверный логин или пароль",
             headers={'WWW-Authenticate': 'Bearer'},
         )
+
+    # Пароль верный, но хеш старый (bcrypt или другие параметры Argon2) — тихо пересчитываем его.
+    # Новый хеш и UPDATE делаем уже после ответа: токены от них не зависят.
+    if password_needs_rehash(user["hashed_password"]):
+        background_tasks.add_task(rehash_password, pool, user["username"], form_data.password, redis)
     
-    return create_tokens(data={"sub": user["username"]})
+    return await issue_tokens(redis, user["username"])
+
+
+# Обмен refresh токена на новую пару. Старый refresh токен при этом гасится (ротация),
+# так что украденный и уже использованный токен второй раз не сработает.
+@router.post('/refresh', response_model=Token)
+async def refresh_tokens(body: RefreshRequest, redis = Depends(get_redis)):
+    username = await consume_refresh_token(redis, body.refresh_token)
+    if username is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Недействительный refresh токен",
+            headers={'WWW-Authenticate': 'Bearer'},
+        )
+    return await issue_tokens(redis, username)
 
 @router.get('/me', summary='Get current user info', response_model=UserOut)
 async def read_users_me(current_user: dict = Depends(get_current_user)):
@@ -184,4 +625,18 @@ async def read_users_me(current_user: dict = Depends(get_current_user)):
 async def protected_route(current_user: dict = Depends(get_current_user)):
     # Мы ожидаем словарь (dict) и берем из него имя пользователя
     username = current_user['username']
-    return {'message': f'Привет, {username}! Это защищенная зона'}
\ No newline at end of file
+    return {'message': f'Привет, {username}! Это защищенная зона'}
+
+
+# Выход: отзываем текущий access токен (он больше не пройдет get_current_user)
+# и гасим refresh токен, выданный вместе с ним
+@router.post('/logout')
+async def logout(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    current_user: dict = Depends(get_current_user),
+    redis = Depends(get_redis)
+):
+    payload = decode_token(credentials.credentials)
+    await revoke_session(redis, payload)
+    _auth_cache.pop(_token_key(credentials.credentials), None)
+    return {'message': f"Пользователь {current_user['username']} вышел из системы"}
@@ -4,6 +4,16 @@
 
 # Поддержка асинхронного программирования для не блокирующих операций.
 import asyncio
+# Факториал считаем через GMP (gmpy2.fac): разбиение пополам и быстрое умножение больших чисел,
+# заметно быстрее даже math.factorial. Перевод mpz в десятичную строку тоже делает GMP —
+# в десятки раз быстрее str(int) и без ограничения Python в 4300 цифр.
+import gmpy2
+# uvloop — event loop на libuv, быстрее стандартного asyncio. Под Windows его нет
+# (в requirements он только для других платформ), тогда остаемся на обычном цикле.
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
 # Модуль Python для записи логов (отладка, ошибки, информация).
 import logging
 import asyncpg
@@ -11,11 +21,14 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from pydantic import BaseModel
 from dotenv import load_dotenv
 from auth import get_current_user
+from database import STATEMENT_CACHE_SIZE, MAX_INACTIVE_CONNECTION_LIFETIME
 from celery_worker import celery_app
+from celery.signals import worker_process_init, worker_process_shutdown
+from celery.utils.time import get_exponential_backoff_interval
 import os
 
 import redis.asyncio as aioredis
-import json
+import orjson
 
 
 import smtplib
@@ -55,109 +68,232 @@ class SumRequest(BaseModel):
 
 
 
-# --- 3. Celery Задачи с ЭКСПОНЕНЦИАЛЬНОЙ ЗАДЕРЖКОЙ ---
+# --- 3. Пул соединений воркера ---
+# Раньше каждая задача делала asyncpg.connect и close ради одного INSERT, то есть каждый раз
+# платила за TCP-рукопожатие и аутентификацию в Postgres. Теперь каждый процесс воркера
+# держит свой пул и свой event loop. Пул asyncpg привязан к циклу, в котором создан,
+# поэтому задачи запускаются в этом же цикле через _run_in_worker_loop, а не через asyncio.run.
+# Записи в calculations сознательно не копим в пачки между задачами: процесс prefork-воркера
+# выполняет задачи строго по одной, а цикл крутится только внутри задачи. Пачка из нескольких
+# задач означала бы либо ожидание следующей задачи (результат висит в памяти и теряется при падении),
+# либо сбой записи уже после того, как задача отчиталась об успехе и не может уйти на повтор.
+# Один INSERT на уже открытом соединении из пула — это один round-trip, и он остается внутри задачи.
+WORKER_POOL_MIN_SIZE = 2
+WORKER_POOL_MAX_SIZE = 10
+
+# Обе задачи пишут результат одним и тем же текстом запроса: asyncpg готовит его
+# на соединении один раз (кэш подготовленных выражений), дальше — только Bind/Execute
+INSERT_CALCULATION_SQL = 'INSERT INTO calculations (username, task, result) VALUES ($1, $2, $3)'
+
+_worker_loop: asyncio.AbstractEventLoop | None = None
+_worker_pool: asyncpg.Pool | None = None
+# Клиент Redis для уведомлений тоже один на процесс: раньше каждое уведомление открывало
+# и закрывало свое соединение, и это стоило задаче лишних round-trip'ов на каждом вызове
+_worker_redis: aioredis.Redis | None = None
+
+
+# Адреса сервисов читаем из окружения один раз при импорте, а не на каждую задачу.
+# ИСПРАВЛЕНО: Формируем правильную DSN-строку в формате URL из .env
+DB_PASSWORD = os.getenv('DB_PASSWORD') or ''
+DB_CONNINFO = (f"postgres://{os.getenv('DB_USER')}:{DB_PASSWORD}"
+               f"@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}")
+REDIS_URL = os.getenv('REDIS_URL', 'redis://redis:6379/0')
+
+
+@worker_process_init.connect
+def init_worker_loop(**kwargs):
+    """
+    Создает event loop процесса воркера. Сигнал приходит в каждый дочерний процесс prefork
+    уже после fork, так что цикл родителя (если он был) дочерним процессам не достается.
+    """
+    global _worker_loop, _worker_pool, _worker_redis
+    _worker_loop = uvloop.new_event_loop() if uvloop else asyncio.new_event_loop()
+    asyncio.set_event_loop(_worker_loop)
+    _worker_pool = None
+    _worker_redis = None
+
+
+@worker_process_shutdown.connect
+def close_worker_loop(**kwargs):
+    """Закрывает пул соединений, клиент Redis и event loop при остановке процесса воркера."""
+    global _worker_loop, _worker_pool, _worker_redis
+    if _worker_loop is None:
+        return
+    if _worker_pool is not None:
+        _worker_loop.run_until_complete(_worker_pool.close())
+        _worker_pool = None
+    if _worker_redis is not None:
+        _worker_loop.run_until_complete(_worker_redis.aclose())
+        _worker_redis = None
+    _worker_loop.run_until_complete(_worker_loop.shutdown_asyncgens())
+    _worker_loop.close()
+    _worker_loop = None
+
+
+async def _get_worker_pool() -> asyncpg.Pool:
+    """
+    Возвращает пул процесса воркера, при первом обращении создает его.
+    Создаем лениво, а не в worker_process_init: если база еще не поднялась,
+    упадет задача (и уйдет на повтор), а не весь процесс воркера.
+    """
+    global _worker_pool
+    if _worker_pool is None:
+        # Отладочный вывод: печатаем адрес, по которому пытаемся подключиться (без пароля)
+        safe_url = DB_CONNINFO.replace(DB_PASSWORD, '********') if DB_PASSWORD else DB_CONNINFO
+        logger.info("[CELERY DEBUG] Создаю пул соединений по адресу %s", safe_url)
+        _worker_pool = await asyncpg.create_pool(
+            dsn=DB_CONNINFO,
+            min_size=WORKER_POOL_MIN_SIZE,
+            max_size=WORKER_POOL_MAX_SIZE,
+            # Те же настройки, что у пула приложения: подготовленные выражения живут,
+            # пока живет соединение, поэтому простаивающие соединения не закрываем
+            statement_cache_size=STATEMENT_CACHE_SIZE,
+            max_inactive_connection_lifetime=MAX_INACTIVE_CONNECTION_LIFETIME,
+        )
+    return _worker_pool
+
+
+def _get_worker_redis() -> aioredis.Redis:
+    """Возвращает клиент Redis процесса воркера (соединение откроется при первой команде)."""
+    global _worker_redis
+    if _worker_redis is None:
+        _worker_redis = aioredis.from_url(REDIS_URL)
+    return _worker_redis
+
+
+def _run_in_worker_loop(coro):
+    """
+    Выполняет корутину задачи в постоянном event loop процесса воркера
+    (вместо asyncio.run, который на каждую задачу создает и разрушает цикл).
+    """
+    if _worker_loop is None:
+        # worker_process_init не приходит при --pool=solo и при вызове задачи напрямую
+        init_worker_loop()
+    return _worker_loop.run_until_complete(coro)
+
+
+# --- 4. Celery Задачи с ЭКСПОНЕНЦИАЛЬНОЙ ЗАДЕРЖКОЙ ---
 # ВАЖНО: Мы больше не используем декоратор @retry от tenacity,
 # так как у Celery есть свои, более мощные механизмы для повторных попыток.
 
+# Повторяем только временные сбои: база или Redis недоступны, соединение оборвалось,
+# истек таймаут (TimeoutError и ConnectionError — подклассы OSError). Ошибка в самих
+# данных или в коде на повторе не исправится — такая задача сразу завершается с FAILURE.
+TRANSIENT_ERRORS = (
+    OSError,
+    asyncpg.PostgresConnectionError,
+    asyncpg.TooManyConnectionsError,
+    asyncpg.CannotConnectNowError,
+)
+TASK_MAX_RETRIES = 3
+RETRY_BACKOFF_SECONDS = 5
+RETRY_BACKOFF_MAX_SECONDS = 60
+
+
+def _retry_countdown(retries: int) -> int:
+    """
+    Задержка перед повтором: экспонента 5, 10, 20 с как верхняя граница, а сама задержка —
+    случайная в этих пределах (full jitter), чтобы задачи, упавшие на одном сбое базы,
+    не вернулись к ней все в одну и ту же секунду.
+    """
+    return get_exponential_backoff_interval(
+        factor=RETRY_BACKOFF_SECONDS,
+        retries=retries,
+        maximum=RETRY_BACKOFF_MAX_SECONDS,
+        full_jitter=True,
+    )
+
+
+# Логгер вызываем с %s-параметрами, а не f-строками: строка собирается, только если запись
+# действительно выводится (для факториала это тысячи цифр на каждую задачу).
+
+# Асинхронная часть задач вынесена в обычные корутины верхнего уровня:
+# сами задачи остаются синхронными def (prefork-воркер не умеет await) и запускают
+# эти корутины в постоянном цикле процесса через _run_in_worker_loop.
+async def _save_calculation(username: str, task: str, result: str) -> None:
+    """Сохраняет результат вычисления в calculations."""
+    # Пул процесса воркера вместо нового подключения на каждую задачу. Запрос один,
+    # поэтому pool.execute сам берет и возвращает соединение, без async with pool.acquire()
+    pool = await _get_worker_pool()
+    await pool.execute(INSERT_CALCULATION_SQL, username, task, result)
+
+
+async def _publish_notification(username: str, text: str) -> None:
+    """Отправляет уведомление в канал Redis, который слушает FastAPI (и пересылает в WebSocket)."""
+    try:
+        message = {
+            "username": username,
+            "message": text
+        }
+        # Публикуем сообщение в канал "celery_notifications" через клиент процесса воркера:
+        # один PUBLISH на уже открытом соединении вместо подключения и закрытия на каждую задачу.
+        # orjson сразу отдает bytes в UTF-8 (без \uXXXX для кириллицы) — сообщение короче
+        await _get_worker_redis().publish("celery_notifications", orjson.dumps(message))
+    except Exception as redis_err:
+        # Уведомление не критично: результат уже в базе, задачу из-за него не повторяем
+        logger.error('[CELERY] Ошибка отправки в Redis: %s', redis_err)
+
+
+async def _save_and_notify(username: str, task: str, result: str, text: str) -> None:
+    """
+    Сохраняет результат и сразу публикует уведомление за один запуск цикла воркера.
+    Уведомление идет строго после записи: клиент, получив его, уже найдет результат в базе.
+    """
+    await _save_calculation(username, task, result)
+    await _publish_notification(username, text)
+
+
+def sum_range(start: int, end: int) -> int:
+    """Сумма целых чисел от start до end включительно по формуле Гаусса: O(1) вместо прохода по диапазону."""
+    if start > end:
+        return 0
+    # Произведение двух соседних по четности множителей всегда четное — деление точное
+    return (end - start + 1) * (start + end) // 2
+
+
 @celery_app.task(bind=True, name='compute_factorial_task')
 def compute_factorial_task(self, username: str, n: int):
     """
     Celery-задача для вычисления факториала с механизмом повторных попыток.
-    Эта функция ВЫЗЫВАЕТСЯ синхронно, но ВНУТРИ запускает асинхронный код.
+    Эта функция ВЫЗЫВАЕТСЯ синхронно, а запись в БД и Redis делает в цикле воркера.
     """
-    logger.info(f'[CELERY] Попытка {self.request.retries + 1}. Начато вычисление факториала {n} для {username}')
-
-    # Вся асинхронная логика теперь находится внутри этой вложенной функции
-    async def _run_async_logic():
-    # Симуляция долгой работы
-        try:
-            await asyncio.sleep(5)
-            result = 1
-            for i in range(1, n + 1):
-                result *= i
-
-            # ИСПРАВЛЕНО: Формируем правильную DSN-строку в формате URL
-            # Подключаемся к БД, используя DSN из .env
-            DATABASE_URL = (f"postgres://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}"
-                            f"@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}")
-
-            # Отладочный вывод: печатаем адрес, по которому пытаемися подключиться
-            logger.info(f"[CELERY DEBUG] Пытаюсь подключиться по адресу {DATABASE_URL.replace(os.getenv('DB_PASSWORD'), '********' )}")
-
-    # Напрямую работаем с БД, без вложенных функций
-            conn = await asyncpg.connect(dsn=DATABASE_URL)
-            try:
-                await conn.execute(
-                        'INSERT INTO calculations (username, task, result) VALUES ($1, $2, $3)',
-                        username, f"factorial of {n}", str(result)
-                    )
-            finally:
-                await conn.close()
-
-            logger.info(f'[CELERY] Успешно вычислен факториал {n} = {result}')
-
-            # --- НОВЫЙ БЛОК: ОТПРАВЛЯЕМ СИГНАЛ В REDIS ---
-            try:
-                redis_client = await aioredis.from_url(os.getenv('REDIS_URL', 'redis://redis:6379/0'))
-                message = {
-                    "username": username,
-                    "message": f"Факториал числа {n} успешно вычислен! Результат: {result}"
-                }
-                # Публикуем сообщение в канал "celery_notifications"
-                await redis_client.publish("celery_notifications", json.dumps(message))
-                await redis_client.aclose()
-            except Exception as redis_err:
-                logger.error(f'[CELERY] Ошибка отправки в Redis: {redis_err}')
-
-            return result
-    
-        except Exception as e:
-            logger.warning(f'[CELERY] Ошибка при выполнении задачи: {e}. Попытка повтора...')
-            # ИЗМЕНЕНИЕ: Используем экспоненциальную задержку
-            # 1-я попытка через 5с, 2-я через 10с, 3-я через 20с
-            delay = 5 * (2 ** self.request.retries)
-            raise self.retry(exc=e, countdown=delay, max_retries=3)
-
-    # Запускаем нашу асинхронную функцию и ждем ее завершения.
-    # Это решает проблему "coroutine is not JSON serializable".
-    return asyncio.run(_run_async_logic())
-
-# Celery задача compute_sum_range, которая вычисляет сумму чисел в заданном диапазоне асинхронно.
+    logger.info('[CELERY] Попытка %s. Начато вычисление факториала %s для %s', self.request.retries + 1, n, username)
+
+    try:
+        result = gmpy2.fac(n)
+        result_str = str(result)
+        _run_in_worker_loop(_save_and_notify(
+            username, f"factorial of {n}", result_str,
+            f"Факториал числа {n} успешно вычислен! Результат: {result_str}",
+        ))
+        # Сам результат в лог не пишем: для больших n это мегабайты в одной строке
+        logger.info('[CELERY] Успешно вычислен факториал %s (%s цифр)', n, len(result_str))
+        # Возвращаем ту же десятичную строку, что и в БД: большое int Celery не смог бы ни
+        # залогировать, ни сериализовать (str(int) длиннее 4300 цифр бросает ValueError)
+        return result_str
+
+    except TRANSIENT_ERRORS as e:
+        logger.warning('[CELERY] Ошибка при выполнении задачи: %s. Попытка повтора...', e)
+        raise self.retry(exc=e, countdown=_retry_countdown(self.request.retries), max_retries=TASK_MAX_RETRIES)
+
+# Celery задача compute_sum_range, которая вычисляет сумму чисел в заданном диапазоне.
 @celery_app.task(bind=True, name='compute_sum_range_task')
 def compute_sum_range_task(self, start: int, end: int, username: str):
     """
     Celery-задача для вычисления суммы в диапазоне.
     Выполняется отдельным процессом-воркером.
     """
-    logger.info(f"[CELERY] Попытка {self.request.retries + 1}. Начало вычисления суммы от {start} до {end} для {username}")
-
-    async def _run_async_logic():
-        try:
-            await asyncio.sleep(3)
-            result = sum(range(start, end + 1))
-
-            DATABASE_URL = (f"postgres://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}"
-                            f"@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}")
-
-            logger.info(f"[CELERY DEBUG] Пытаюсь подключиться по адресу: {DATABASE_URL.replace(os.getenv('DB_PASSWORD'), '********')}")
-
-            conn = await asyncpg.connect(dsn=DATABASE_URL)
-            try:
-                await conn.execute(
-                        'INSERT INTO calculations (username, task, result) VALUES ($1, $2, $3)',
-                        username, f"sum from {start} to {end}", result
-                    )
-            finally:
-                await conn.close()
-                    
-            logger.info(f"[CELERY] Успешно вычислена сумма от {start} до {end} = {result}")
-            return result
-        except Exception as e:
-            logger.warning(f'[CELERY] Ошибка при выполнении задачи: {e}. Попытка повтора...')
-            delay = 5 * (2 ** self.request.retries )
-            raise self.retry(exc=e, countdown=delay, max_retries=3)
-    
-    return asyncio.run(_run_async_logic())
+    logger.info('[CELERY] Попытка %s. Начало вычисления суммы от %s до %s для %s', self.request.retries + 1, start, end, username)
+
+    try:
+        result = sum_range(start, end)
+        _run_in_worker_loop(_save_calculation(username, f"sum from {start} to {end}", str(result)))
+
+        logger.info('[CELERY] Успешно вычислена сумма от %s до %s = %s', start, end, result)
+        return result
+    except TRANSIENT_ERRORS as e:
+        logger.warning('[CELERY] Ошибка при выполнении задачи: %s. Попытка повтора...', e)
+        raise self.retry(exc=e, countdown=_retry_countdown(self.request.retries), max_retries=TASK_MAX_RETRIES)
 
 @celery_app.task(name='send_email_to_user')
 def send_email_to_user_task(email: str, product_id: int):
@@ -208,23 +344,24 @@ def send_email_to_user_task(email: str, product_id: int):
         # 3 Добавляем HTML как главную альтернативку
         msg.add_alternative(html_content, subtype='html')
 
-        print(f"⏳ Подключаемся к серверу Google для отправки на {email}...")
+        logger.debug("Подключаемся к SMTP-серверу для отправки на %s...", email)
 
         # 3. Подключаемся к серверу Google (через защищенный порт 465) и отправляем
         with smtplib.SMTP_SSL(settings.SMTP_HOST, settings.SMTP_PORT) as server:
             server.login(settings.SMTP_USER, settings.SMTP_PASSWORD)
             server.send_message(msg)
 
-            print(f"✅ Боевое письмо успешно отправлено на {email}!")
+            logger.debug("Письмо успешно отправлено на %s", email)
             return True
         
     except Exception as e:
-        print(f"❌ Ошибка при отправке письма: {e}")
+        # Ошибку оставляем видимой: на уровне debug неотправленное письмо потерялось бы в логах
+        logger.warning("Ошибка при отправке письма на %s: %s", email, e)
         return False
 
 
 
-# --- 4. Эндпоинты, которые ставят задачи в очередь ---
+# --- 5. Эндпоинты, которые ставят задачи в очередь ---
 
 @router.post('/factorial', status_code=status.HTTP_202_ACCEPTED)
 async def start_factorial_computation(
@@ -1,6 +1,10 @@
 from celery import Celery
+import json
 import os
+import re
+import orjson
 from dotenv import load_dotenv
+from kombu.serialization import register
 
 # Загружаем переменные окружения ПЕРЕД тем, как их использовать.
 # Это гарантирует, что os.getenv() найдет REDIS_URL из .env файла.
@@ -14,6 +18,42 @@ load_dotenv()
 # Если переменной нет, используется стандартный локальный URL.
 REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
 
+# Очередь для задач, которые в основном ждут сеть (см. task_routes ниже)
+IO_QUEUE = 'io'
+
+# Соединения с Redis (брокер и хранилище результатов) держим в пулах и переиспользуем.
+# Потолок с запасом покрывает 50 потоков IO-воркера: при исчерпании пула redis-py
+# не ждет, а бросает ошибку, поэтому меньше concurrency воркера его делать нельзя.
+REDIS_MAX_CONNECTIONS = 64
+# Как часто проверять простаивающее соединение PING'ом перед использованием (сек)
+REDIS_HEALTH_CHECK_INTERVAL = 30
+
+
+# Сериализатор сообщений и результатов на orjson (C-расширение) вместо стандартного json.
+# Оговорка: orjson работает только с целыми в 64 бита. dumps на большом int падает с TypeError,
+# а loads молча превращает его в float с потерей точности. Поэтому такие сообщения идут через
+# стандартный json: при записи — по ошибке orjson, при чтении — если в тексте есть число
+# из 19+ цифр (длинные цифры внутри строк, например факториал, тоже уходят этим путем — медленнее, но точно).
+ORJSON_CONTENT_TYPE = 'application/x-orjson'
+_LONG_NUMBER = re.compile(rb'\d{19}')
+
+
+def orjson_dumps(obj) -> bytes:
+    try:
+        return orjson.dumps(obj)
+    except TypeError:
+        return json.dumps(obj).encode()
+
+
+def orjson_loads(data):
+    if isinstance(data, str):
+        data = data.encode()
+    if _LONG_NUMBER.search(data):
+        return json.loads(data)
+    return orjson.loads(data)
+
+
+register('orjson', orjson_dumps, orjson_loads, content_type=ORJSON_CONTENT_TYPE, content_encoding='binary')
 
 
 # Создаем главный экземпляр Celery
@@ -31,10 +71,41 @@ celery_app = Celery(
 # Опциональная конфигурация для улучшения работы
 celery_app.conf.update(
     task_track_started=True, # Отслеживать, когда задача началась
-    task_serializer='json',
-    accept_content=['json'], 
-    result_serializer='json',
+    task_serializer='orjson',
+    # json оставляем в accept_content, чтобы воркер дочитал задачи, поставленные до перехода на orjson
+    accept_content=['orjson', 'json'],
+    result_serializer='orjson',
     timezone='UTC',
     enable_utc=True,
+    # Отправка писем — это почти только ожидание SMTP-сервера. Такие задачи уходят в отдельную
+    # очередь 'io', которую обслуживает воркер с пулом потоков и высокой concurrency:
+    #   celery -A celery_worker.celery_app worker --pool=threads --concurrency=50 -Q io
+    # Вычисления (compute_*) остаются в очереди по умолчанию на prefork-воркере: факториал
+    # упирается в CPU и GIL, а event loop и пул asyncpg у них свои на каждый процесс,
+    # и делить их между потоками или green-потоками нельзя.
+    task_routes={
+        'send_email_to_user': {'queue': IO_QUEUE},
+    },
+    # Честное распределение: воркер берет из брокера по одной задаче за раз. С множителем
+    # по умолчанию (4) процесс, занятый факториалом большого n, держал бы у себя еще
+    # несколько задач, пока соседние процессы простаивают.
+    worker_prefetch_multiplier=1,
+    # Подтверждаем задачу после выполнения, а не при получении: если процесс воркера упадет
+    # посреди задачи, брокер отдаст ее другому воркеру, а не потеряет
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
+    # Публикация задачи (.delay из FastAPI) берет готовое соединение из пула,
+    # а не открывает новое TCP-соединение к Redis на каждый вызов
+    broker_pool_limit=10,
+    # TCP keepalive и health check: соединение, тихо оборванное сетью или Docker,
+    # обнаруживается до отправки задачи, а не ошибкой посреди публикации
+    broker_transport_options={
+        'max_connections': REDIS_MAX_CONNECTIONS,
+        'socket_keepalive': True,
+        'health_check_interval': REDIS_HEALTH_CHECK_INTERVAL,
+    },
+    redis_max_connections=REDIS_MAX_CONNECTIONS,
+    redis_socket_keepalive=True,
+    redis_backend_health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
 )
 
@@ -1,4 +1,5 @@
 import sys # <-- Добавляем импорт для системных утилит
+from functools import cached_property, lru_cache
 from typing import Optional
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -13,6 +14,14 @@ class Settings(BaseSettings):
 
     # Ссылка целиком (для продакшена/Render)
     DATABASE_URL: Optional[str] = None 
+
+    # Размер пула asyncpg на один процесс приложения. DB_POOL_MIN соединений открываются
+    # сразу при старте, поэтому первые запросы не платят за подключение к Postgres.
+    # DB_POOL_MAX * число воркеров gunicorn должно помещаться в max_connections Postgres (100 по умолчанию).
+    DB_POOL_MIN: int = 10
+    DB_POOL_MAX: int = 50
+    # Запрос дольше этого (в секундах) прерывается, а не держит соединение пула бесконечно
+    DB_COMMAND_TIMEOUT: float = 30
     
     # --- 2. Настройки безопасности ---
     SECRET_KEY: str
@@ -50,7 +59,8 @@ class Settings(BaseSettings):
         extra="ignore" # Игнорировать лишние переменные в .env
     )
 
-    @property
+    # Настройки после создания не меняются, поэтому URL собираем один раз и запоминаем
+    @cached_property
     def get_database_url(self) -> str:
         """
         Собирает URL базы данных. 
@@ -74,5 +84,14 @@ class Settings(BaseSettings):
 
         return url
     
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """
+    Единственный экземпляр настроек: .env читается и валидируется один раз на процесс.
+    Годится и как зависимость FastAPI (Depends(get_settings)), и для подмены в тестах.
+    """
+    return Settings() # type: ignore
+
+
 # Создаем экземпляр настроек, который будем импортировать
-settings = Settings() # type: ignore
+settings = get_settings()
@@ -1,6 +1,7 @@
 # Управление соединением с базой данных.
 import asyncio
 import asyncpg
+from redis import asyncio as aioredis
 from fastapi import Request, Depends, BackgroundTasks
 from config import settings
 from repositories.product_repository import ProductRepository
@@ -8,6 +9,18 @@ from services.product_service import ProductService
 
 
 
+# Размер кэша подготовленных выражений asyncpg на одно соединение.
+# Задаем явно: при 0 каждый запрос заново разбирался бы и планировался сервером.
+# Разных запросов в приложении немного, так что с запасом помещаются все.
+STATEMENT_CACHE_SIZE = 1024
+# 0 — подготовленное выражение живет в кэше, пока живо соединение.
+# По умолчанию asyncpg выбрасывает его через 300 с и готовит заново на следующем запросе.
+MAX_CACHED_STATEMENT_LIFETIME = 0
+# 0 — не закрывать простаивающие соединения: вместе с соединением пропадают
+# и его подготовленные выражения, и после паузы в трафике все пришлось бы готовить заново.
+MAX_INACTIVE_CONNECTION_LIFETIME = 0
+
+
 # Эта функция будет вызываться один раз при старте приложения
 async def connect_to_db(app):
     # Создает пул соединений и сохраняет его для хранения общих ресурсов
@@ -35,12 +48,17 @@ async def connect_to_db(app):
             # 1. Создаем пул
             # app.state - специальный объект для хранения общих ресурсов
             # Используем DATABASE_URL, который уже содержит все данные
+            # create_pool сам открывает min_size соединений до возврата — пул уже "прогрет"
             app.state.pool = await asyncpg.create_pool(
                 dsn=db_url,
-                min_size=1, 
-                max_size=20
+                min_size=settings.DB_POOL_MIN,
+                max_size=settings.DB_POOL_MAX,
+                command_timeout=settings.DB_COMMAND_TIMEOUT,
+                statement_cache_size=STATEMENT_CACHE_SIZE,
+                max_cached_statement_lifetime=MAX_CACHED_STATEMENT_LIFETIME,
+                max_inactive_connection_lifetime=MAX_INACTIVE_CONNECTION_LIFETIME
             )
-            print('✅ Database connection pool created successfully')
+            print(f'✅ Database connection pool created successfully ({settings.DB_POOL_MIN}-{settings.DB_POOL_MAX} connections)')
 
 
 
@@ -68,13 +86,20 @@ async def close_db_connection(app):
     print('Database connection pool closed')
 
 # Это зависимость (Dependency)
-# Любой эндпоинт сможет запросить её для получания доступа к пулу
-def get_pool(request: Request) -> asyncpg.Pool:
+# Любой эндпоинт сможет запросить её для получания доступа к пулу.
+# Зависимости объявлены через async def: обычную def FastAPI выполняет в пуле потоков,
+# и на каждый запрос платил бы за переход в поток ради чтения одного атрибута.
+async def get_pool(request: Request) -> asyncpg.Pool:
     # Зависимость для получения пула соединений в эндпоинтах.
     # FastAPI автоматически передаст сюда объект 'request', из которого можно получить доступ к app.state.pool
     return request.app.state.pool
 
 
+# Зависимость для доступа к клиенту Redis (в тестах его нет — вернется None)
+async def get_redis(request: Request) -> aioredis.Redis | None:
+    return getattr(request.app.state, 'redis', None)
+
+
 # Dependency Injection 
 async def get_product_service(
     request: Request,
@@ -1,17 +1,14 @@
-import jwt
-import os
 from fastapi import Request
-
-
-SECRET_KEY = os.getenv("SECRET_KEY", "a_very_secret_key_for_local_development")
-ALGORITHM = 'HS256'
+# Токен проверяем той же функцией, что и WebSocket: подпись, срок, тип и отзыв через /auth/logout
+# (см. auth.decode_access_token)
+from auth import decode_access_token
 
 
 # --- 1. Вспомогательная функция проверки токена ---
-def authenticate_user(request: Request) -> str:
+async def authenticate_user(request: Request, redis=None) -> str:
     """
     Достает токен из заголовка, проверяет его и возвращает имя пользователя.
-    Если что-то не так — выбрасывает ошибку.
+    redis нужен для проверки отозванных токенов. Если что-то не так — выбрасывает ошибку.
     """
     # 1. Достаем заголовок Authorization
     auth_header = request.headers.get("Authorization")
@@ -21,20 +18,16 @@ def authenticate_user(request: Request) -> str:
     
     # 2. Ожидаем формат "Bearer <token>"
     try:
-        scheme, token = auth_header.split()
+        # partition вместо split: без списка, и лишние пробелы/части просто не пройдут проверку подписи
+        scheme, _, token = auth_header.partition(' ')
         if scheme.lower() != 'bearer':
             raise Exception("Invalid authentication scheme")
     
-        # 3. Расшифровываем токен
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-
-        if username is None:
-            raise Exception("Invalid token: username not found")
-        
-        return username
+        # 3. Расшифровываем токен. Refresh токен и отозванный токен здесь не подходят — как и в get_current_user
+        payload = await decode_access_token(token, redis)
+        return payload['sub']
     
-    # Ловим любую ошибку (просрочен, мусор вместо токена, ошибка подписи)
+    # Ловим любую ошибку (просрочен, отозван, мусор вместо токена, ошибка подписи)
     # и возвращаем понятное сообщение
     except Exception:
-        raise Exception("Could not validate credentials (Invalid Token)")
\ No newline at end of file
+        raise Exception("Could not validate credentials (Invalid Token)")
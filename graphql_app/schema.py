@@ -1,7 +1,19 @@
+import logging
+from functools import lru_cache, partial
+import asyncpg
+import orjson
 import strawberry
+from fastapi import Request
+from strawberry.dataloader import DataLoader
+from strawberry.extensions import ParserCache, ValidationCache
+from strawberry.schema.config import StrawberryConfig
 from strawberry.types import Info
+from strawberry.types.nodes import SelectedField
 from typing import Optional, List
 from graphql_app.auth import authenticate_user
+from services.product_service import GRAPHQL_PRODUCTS_CACHE_KEY, GRAPHQL_PRODUCTS_CACHE_TTL
+
+logger = logging.getLogger(__name__)
 
 
 # --- Создаем "Слепок" товара (ProductType) ---
@@ -9,67 +21,165 @@ from graphql_app.auth import authenticate_user
 # Поля должны совпадать с тем, что вернет база данных.
 @strawberry.type
 class ProductType:
+    # __slots__ вместо __dict__ на каждом объекте: экземпляр занимает ~64 байта вместо ~350.
+    # Strawberry это не мешает — поля он берет из аннотаций, а значения читает через resolve_field.
+    # Списки товаров резолверы отдают строками из базы, объект строится только в addProduct.
+    __slots__ = ('id', 'name', 'description', 'price')
+
     id: strawberry.ID # strawberry.ID (это спец-тип для GraphQL, понимает UUID)
     name: str
     description: Optional[str] # Optional означает, что поле может быть null(пустым)
     price: int
 
 
+# Товар на входе пакетного добавления (mutation addProducts)
+@strawberry.input
+class ProductInput:
+    name: str
+    price: int
+    description: Optional[str] = None
+
+
+def resolve_field(source, name: str):
+    """
+    Резолвер полей по умолчанию для схемы. Списки товаров резолверы отдают как есть —
+    строками asyncpg (Record) или словарями из кэша, без ProductType на каждую строку;
+    их поля читаем по ключу. Обычные объекты (ProductType из мутаций) — как раньше, через getattr.
+    """
+    try:
+        return source[name]
+    except TypeError:
+        return getattr(source, name)
+
+
+# --- DataLoader для товаров ---
+# Все product(id) одного запроса, запрошенные в одном такте event loop
+# (например, query { a: product(productId: 1) b: product(productId: 2) }),
+# DataLoader собирает в один SELECT ... WHERE id = ANY($1) вместо запроса на каждый id.
+# Тот же загрузчик подойдет для будущих связанных полей (owner, category) — без N+1.
+PRODUCTS_BY_IDS_SQL = "SELECT id, name, description, price FROM products WHERE id = ANY($1::int[])"
+
+
+async def load_products(pool: asyncpg.Pool, ids: List[int]) -> List[Optional[asyncpg.Record]]:
+    """Загружает товары пачкой. Ответ — в том же порядке, что и ids (None для ненайденных)."""
+    rows = await pool.fetch(PRODUCTS_BY_IDS_SQL, list(ids))
+    by_id = {row["id"]: row for row in rows}
+    return [by_id.get(i) for i in ids]
+
+
+async def get_context(request: Request) -> dict:
+    """
+    Контекст GraphQL на каждый запрос. Strawberry дополнит его request/response.
+    Пул и Redis достаем из app.state один раз здесь, а не в каждом резолвере.
+    Загрузчик живет ровно один запрос — его кэш не переживет изменения данных.
+    """
+    pool = getattr(request.app.state, 'pool', None)
+    return {
+        "pool": pool,
+        "redis": getattr(request.app.state, 'redis', None),
+        "product_loader": DataLoader(load_fn=partial(load_products, pool)),
+    }
+
+
+# --- Страницы списка товаров ---
+# Выбираем только те колонки, которые клиент запросил в { products { ... } }.
+# Имена колонок берутся только из этого кортежа, а не из текста запроса — подстановка в SQL безопасна
+PRODUCT_COLUMNS = ('id', 'name', 'description', 'price')
+PRODUCTS_PAGE_SIZE = 100
+# Больше за один запрос не отдаем, сколько бы ни попросил клиент
+PRODUCTS_PAGE_MAX = 500
+
+
+def _requested_columns(selections) -> tuple:
+    """Колонки products, запрошенные в выборке (с учетом фрагментов). id нужен всегда — по нему страницы."""
+    names = set()
+    stack = list(selections)
+    while stack:
+        selection = stack.pop()
+        if isinstance(selection, SelectedField):
+            names.add(selection.name)
+        else:
+            # ...on ProductType { } и ...ИмяФрагмента — поля лежат уровнем ниже
+            stack.extend(selection.selections)
+    return tuple(column for column in PRODUCT_COLUMNS if column == 'id' or column in names)
+
+
+@lru_cache(maxsize=16)
+def _products_page_sql(columns: tuple) -> str:
+    # Наборов колонок всего 8, поэтому текст SQL собирается один раз на набор —
+    # и asyncpg видит ту же строку, то есть берет подготовленный запрос из своего кэша
+    return f"SELECT {', '.join(columns)} FROM products WHERE id > $1 ORDER BY id LIMIT $2"
+
+
 # --- 2. Резолверы
 
 # ЧТЕНИЕ
 # info: Info — это специальный параметр Strawberry, в нем лежит объект запроса
-async def get_products(info: Info) -> List[ProductType]:
-    # 1. Достаем объект request из контекста Strawberry
-    request = info.context['request']
+async def get_products(info: Info, first: int = PRODUCTS_PAGE_SIZE, after: Optional[int] = None) -> List[ProductType]:
+    """
+    Страница товаров по возрастанию id: first штук после товара с id = after.
+    Следующая страница — after = id последнего товара текущей.
+    """
+    # 1-2. Пул соединений с БД уже лежит в контексте запроса (см. get_context).
+    # Отдельной проверки на None нет: пул создается в lifespan до приема запросов
+    pool = info.context['pool']
 
-    # 2. Через request добираемся до пула соединений с БД
-    pool = request.app.state.pool
+    limit = min(first, PRODUCTS_PAGE_MAX)
+    if limit <= 0:
+        return []
+    after_id = after or 0
+    columns = _requested_columns(info.selected_fields[0].selections)
+    # Страницы с разным набором колонок кэшируются отдельно
+    page_key = f"{after_id}:{limit}:{','.join(columns)}"
 
-    if not pool:
-        raise Exception("Нет подключения к БД!")
+    # Список товаров меняется редко, поэтому сначала смотрим в Redis (как ProductService для REST).
+    # Все страницы лежат полями одного hash — любое изменение товаров сбрасывает их одним DELETE
+    redis = info.context['redis']
+    if redis:
+        try:
+            cached = await redis.hget(GRAPHQL_PRODUCTS_CACHE_KEY, page_key)
+            if cached:
+                return orjson.loads(cached)
+        except Exception:
+            pass # Redis недоступен — идем в базу
     
-    # 3. Делаем SQL-запрос
-    async with pool.acquire() as connection:
-        # Выбираем только те поля, которые нужны нашему ProductType
-        query = "SELECT id, name, description, price FROM products"
-        rows = await connection.fetch(query)
-
-        # 4. Превращаем "сырые" строки БД в красивые объекты ProductType
-        return [
-            ProductType(
-                id=row["id"],
-                name=row["name"],
-                description=row["description"],
-                price=row["price"]
-            )
-            for row in rows
-        ]
+    # 3. Делаем SQL-запрос. Запрос один, поэтому выполняем его прямо на пуле:
+    # pool.fetch сам берет соединение и возвращает его обратно.
+    # Keyset-пагинация: WHERE id > $1 ORDER BY id идет по индексу первичного ключа,
+    # и дальняя страница стоит столько же, сколько первая (OFFSET пролистывал бы все предыдущие строки)
+    rows = await pool.fetch(_products_page_sql(columns), after_id, limit)
+
+    if redis:
+        try:
+            # HSET и EXPIRE — одним пакетом (pipeline без MULTI): один round-trip вместо двух
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.hset(GRAPHQL_PRODUCTS_CACHE_KEY, page_key, orjson.dumps([dict(row) for row in rows]))
+                pipe.expire(GRAPHQL_PRODUCTS_CACHE_KEY, GRAPHQL_PRODUCTS_CACHE_TTL)
+                await pipe.execute()
+        except Exception:
+            pass
+
+    # 4. Строки отдаем как есть: поля ProductType Strawberry прочитает из них по ключу (см. resolve_field).
+    # В строке только запрошенные колонки — незапрошенные поля GraphQL и не читает
+    return rows
 
 
 # ЧТЕНИЕ ОДНОГО ТОВАРА
 # Обрати внимание: возвращаем Optional[ProductType], так как товара может и не быть
 async def get_product(info: Info, product_id: int) -> Optional[ProductType]:
-    request = info.context['request']
-    pool = request.app.state.pool
-
-    if not pool:
-        raise Exception("Нет подключения к БД!")
-
-    async with pool.acquire() as connection:
-        # Используем WHERE id = $1
-        query = "SELECT id, name, description, price FROM products WHERE id = $1"
-        row = await connection.fetchrow(query, product_id)
-
-        if row:
-            return ProductType(
-                id=row["id"],
-                name=row["name"],
-                description=row["description"],
-                price=row["price"]
-            )
-        else:
-            return None # Если не нашли, возвращаем null
+    # Не отдельный SELECT, а загрузчик запроса: соседние product(...) уйдут одним запросом.
+    # Если не нашли, загрузчик вернет None, то есть null
+    return await info.context['product_loader'].load(product_id)
+
+
+async def _drop_products_cache(info: Info) -> None:
+    """Сбрасывает кэш списка товаров GraphQL после изменения товаров."""
+    redis = info.context['redis']
+    if redis:
+        try:
+            await redis.delete(GRAPHQL_PRODUCTS_CACHE_KEY)
+        except Exception as e:
+            logger.warning("Не удалось сбросить кэш товаров GraphQL: %s", e)
 
 
 # ЗАПИСЬ (ТЕПЕРЬ ЗАЩИЩЕНА 🔒)   
@@ -78,28 +188,62 @@ async def create_product(info: Info, name: str, price: int, description: Optiona
 
     # --- ПРОВЕРКА БЕЗОПАСНОСТИ ---
     # Если токена нет или он кривой — тут вылетит ошибка, и код ниже не сработает
-    user = authenticate_user(request)
-    print(f"Запрос выполнил пользователь: {user}")
+    user = await authenticate_user(request, info.context['redis'])
+    logger.debug("Запрос выполнил пользователь: %s", user)
    
-    pool = request.app.state.pool
-
-    if not pool:
-       raise Exception('Нет подключения к БД!')
-
-    async with pool.acquire() as connection:
-        # Мы делаем INSERT и сразу просим вернуть ID созданной строки (RETURNING id)
-        # Это фишка PostgreSQL, чтобы не делать два запроса.
-        query = """
-            INSERT INTO products (name, description, price)
-            VALUES ($1, $2, $3)
-            RETURNING id
-        """
-        # Используем fetchrow, так как ожидаем ровно одну строку ответа (id)
-        row = await connection.fetchrow(query, name, description, price)
-        new_id = row['id']
-
-        # Возвращаем созданный объект, чтобы клиент сразу увидел его ID
-        return ProductType(id=new_id, name=name, description=description, price=price)
+    pool = info.context['pool']
+
+    # Мы делаем INSERT и сразу просим вернуть ID созданной строки (RETURNING id)
+    # Это фишка PostgreSQL, чтобы не делать два запроса.
+    query = """
+        INSERT INTO products (name, description, price)
+        VALUES ($1, $2, $3)
+        RETURNING id
+    """
+    # Используем fetchrow, так как ожидаем ровно одну строку ответа (id)
+    row = await pool.fetchrow(query, name, description, price)
+    new_id = row['id']
+
+    # Новый товар должен сразу появиться в query { products }
+    await _drop_products_cache(info)
+
+    # Возвращаем созданный объект, чтобы клиент сразу увидел его ID
+    return ProductType(id=new_id, name=name, description=description, price=price)
+
+
+# ПАКЕТНАЯ ЗАПИСЬ
+# Все товары — одним INSERT: колонки приходят тремя массивами, unnest разворачивает их в строки.
+# Текст запроса не зависит от размера пачки, поэтому asyncpg подготавливает его один раз
+# на соединение и дальше берет план из своего кэша (в отличие от VALUES ($1,$2,$3),($4,...) на каждый размер)
+PRODUCTS_BULK_INSERT_SQL = """
+    INSERT INTO products (name, description, price)
+    SELECT * FROM unnest($1::text[], $2::text[], $3::int[])
+    RETURNING id, name, description, price
+"""
+# Потолок пачки: один запрос не должен держать соединение и раздувать массивы бесконечно
+PRODUCTS_BULK_MAX = 1000
+
+
+async def create_products(info: Info, items: List[ProductInput]) -> List[ProductType]:
+    user = await authenticate_user(info.context['request'], info.context['redis'])
+    logger.debug("Пакетное добавление товаров: %s шт., пользователь %s", len(items), user)
+
+    if len(items) > PRODUCTS_BULK_MAX:
+        raise Exception(f"Too many products: не больше {PRODUCTS_BULK_MAX} за один запрос")
+    if not items:
+        return []
+
+    rows = await info.context['pool'].fetch(
+        PRODUCTS_BULK_INSERT_SQL,
+        [item.name for item in items],
+        [item.description for item in items],
+        [item.price for item in items],
+    )
+
+    await _drop_products_cache(info)
+    # Товары — строки RETURNING: id берем у базы, а не угадываем по порядку
+    return rows
+
         
 
 # --- 3. Структура API ---
@@ -131,9 +275,25 @@ class Mutation:
     # Strawberry поймет, какие аргументы нужны, посмотрев на функцию create_product
     add_product: ProductType = strawberry.field(resolver=create_product)
 
+    # 'addProducts' — много товаров одним запросом к базе
+    add_products: List[ProductType] = strawberry.field(resolver=create_products)
+
 
 
 
 # --- 4. Сборка Схемы ---
+# Фронтенд шлет одни и те же тексты запросов, поэтому разбор в AST и валидацию по схеме
+# кэшируем по тексту запроса: повторный запрос сразу идет на выполнение.
+# Кэш ограничен — произвольные присланные запросы не раздуют память процесса.
+GRAPHQL_DOCUMENT_CACHE_SIZE = 256
+
 # Важно: теперь передаем и query, и mutation
-schema = strawberry.Schema(query=Query, mutation=Mutation)
\ No newline at end of file
+schema = strawberry.Schema(
+    query=Query,
+    mutation=Mutation,
+    config=StrawberryConfig(default_resolver=resolve_field),
+    extensions=[
+        ParserCache(maxsize=GRAPHQL_DOCUMENT_CACHE_SIZE),
+        ValidationCache(maxsize=GRAPHQL_DOCUMENT_CACHE_SIZE),
+    ],
+)
\ No newline at end of file
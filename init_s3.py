@@ -1,13 +1,18 @@
 import asyncio
 from aioboto3 import Session
 from config import settings # <--- Импортируем объект settings
-import json
 import sys
 
 # Хак для Windows
 if sys.platform == 'win32':
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
+# Политика публичного чтения, заранее сериализованная: при запуске подставляем только имя бакета
+_POLICY_TMPL = (
+    '{"Version":"2012-10-17","Statement":[{"Sid":"PublicRead","Effect":"Allow",'
+    '"Principal":"*","Action":["s3:GetObject"],"Resource":["arn:aws:s3:::%s/*"]}]}'
+)
+
 async def make_bucket_public():
     print(f"Подключение к S3: {settings.S3_ENDPOINT_URL}") # <-- Используем settings.
     
@@ -28,22 +33,8 @@ async def make_bucket_public():
             print(f"Бакет '{bucket_name}' не найден. Создаем...")
             await s3.create_bucket(Bucket=bucket_name)
 
-        # 2. Политика публичного доступа
-        policy = {
-            "Version": "2012-10-17",
-            "Statement": [
-                {
-                    "Sid": "PublicRead",
-                    "Effect": "Allow",
-                    "Principal": "*",
-                    "Action": ["s3:GetObject"],
-                    "Resource": [f"arn:aws:s3:::{bucket_name}/*"]
-                }
-            ]
-        }
-        
-        # 3. Применяем
-        await s3.put_bucket_policy(Bucket=bucket_name, Policy=json.dumps(policy))
+        # 2. Применяем политику публичного доступа
+        await s3.put_bucket_policy(Bucket=bucket_name, Policy=_POLICY_TMPL % bucket_name)
         print(f"✅ Успех! Бакет '{bucket_name}' готов к работе.")
 
 if __name__ == "__main__":
@@ -2,7 +2,7 @@
 import os
 import time
 from redis import asyncio as aioredis
-from fastapi import FastAPI, Request
+from fastapi import FastAPI
 from contextlib import asynccontextmanager
 from config import settings
 
@@ -13,7 +13,7 @@ from config import settings
 from database import connect_to_db, close_db_connection
 
 # Импортируем готовые "удлинители" (роутеры) из каждого модуля
-from auth import router as auth_router
+from auth import router as auth_router, benchmark_password_hash
 
 # Добавляем импорт для роутера продуктов
 from routers.products import router as products_router
@@ -22,11 +22,12 @@ from routers import payments
 
 # Frontend
 from fastapi.staticfiles import StaticFiles # <-- Импорт для папки
-from fastapi.responses import FileResponse # <-- Импорт для отдачи файла
+from fastapi.responses import FileResponse, ORJSONResponse # <-- Импорт для отдачи файла и быстрых JSON-ответов
+from starlette.datastructures import MutableHeaders
 
 # GraphQL
 from strawberry.fastapi import GraphQLRouter
-from graphql_app.schema import schema # Импортируем нашу схему
+from graphql_app.schema import schema, get_context # Импортируем нашу схему и контекст запроса
 
 # S3
 from routers import media, users
@@ -43,10 +44,21 @@ import sentry_sdk
 from prometheus_fastapi_instrumentator import Instrumentator
 
 
-import json
+import orjson
 import asyncio
+import logging
 from websocket import manager
 
+# Режим тестов читаем один раз: от него зависят роутеры и подключения в lifespan
+TESTING = os.getenv('TESTING') == 'True'
+
+# Роутер фоновых задач тянет за собой Celery — в тестах его не импортируем
+if not TESTING:
+    from bg_tasks import router as tasks_router
+
+# Логгер для сообщений на каждый запрос/событие (print писал бы в stdout синхронно на каждое)
+logger = logging.getLogger(__name__)
+
 # Logging
 # import logging
 # from pythonjsonlogger import jsonlogger
@@ -81,16 +93,20 @@ async def listen_to_redis():
 
         async for message in pubsub.listen():
             if message['type'] == 'message':
-                data = json.loads(message['data'])
+                # orjson разбирает bytes из Redis напрямую, без промежуточного decode в str
+                data = orjson.loads(message['data'])
                 target_username = data.get('username')
                 text = data.get('message')
 
-                print(f"📩 Получено из Redis для {target_username}: {text}")
+                logger.debug("📩 Получено из Redis для %s: %s", target_username, text)
                 await manager.send_personal_message(text, target_username)
     except Exception as e:
         print(f"❌ Ошибка прослушивания Redis: {e}")
 
 # --- 2. Управление жизненным циклом приложения ---
+# Потолок соединений в пуле Redis одного процесса API
+REDIS_MAX_CONNECTIONS = 50
+
 # Это как "выключатель" для приложения, нужен для правильного включения и выключения подключения к БД
 # # ИСПРАВЛЕНО: Используем новый, рекомендуемый способ управления жизненным циклом - lifespan.
 @asynccontextmanager
@@ -102,7 +118,7 @@ async def lifespan(app: FastAPI):
 
     # ИСПРАВЛЕНО: Сохраняем жесткую ссылку на задачу, чтобы Питон ее не убил!
     # Запускаем и "якорим" слушателя ТОЛЬКО для реальной работы, отключаем для тестов
-    if os.getenv('TESTING') != 'True':
+    if not TESTING:
         app.state.redis_task = asyncio.create_task(listen_to_redis())
 
     # Инициализируем переменные, чтобы они существовали в любом случае
@@ -111,19 +127,32 @@ async def lifespan(app: FastAPI):
 
     # # --- Начало: Код до yield ---
     # # Выполняется ОДИН РАЗ при старте сервера
-    # Подключаемся, если TESTING не равен 'True'
-    if os.getenv("TESTING") != "True":
+    # Подключаемся, если это не тесты
+    if not TESTING:
         print("Connecting to services...")
 
+        # 0. Замеряем стоимость хеша пароля на этой машине (в потоке, чтобы не блокировать старт)
+        await asyncio.to_thread(benchmark_password_hash)
+
         # 1. Подключение к Postgres
         await connect_to_db(app)
+        # Пул проверяем один раз здесь, а не в каждой функции, которая к нему обращается:
+        # без базы сервер не стартует вовсе
+        if app.state.pool is None:
+            raise RuntimeError("Пул соединений с БД не создан")
 
         # 2. Подключение к Redis
         try:
             print("Connect to Redis...")
             # 'fastapi_redis' — это имя сервиса из docker-compose.yml
             # decode_responses=True — чтобы получать строки, а не байты
-            redis = aioredis.from_url('redis://fastapi_redis:6379', encoding='utf8', decode_responses=True)
+            # Явный пул с потолком соединений: параллельные запросы берут соединения из него,
+            # а не открывают новые без ограничений. from_pool — клиент закроет пул вместе с собой
+            redis_pool = aioredis.ConnectionPool.from_url(
+                'redis://fastapi_redis:6379', encoding='utf8', decode_responses=True,
+                max_connections=REDIS_MAX_CONNECTIONS, socket_keepalive=True,
+            )
+            redis = aioredis.Redis.from_pool(redis_pool)
             app.state.redis = redis
 
             # Инициализируем защиту от спама
@@ -156,7 +185,7 @@ async def lifespan(app: FastAPI):
     # 2. Закрываем Redis
     if app.state.redis:
         print('Closing Redis connection...')
-        await app.state.redis.close()
+        await app.state.redis.aclose()
 
 
 # --- ИНИЦИАЛИЗАЦИЯ SENTRY ---
@@ -175,7 +204,9 @@ app = FastAPI(
     title='My Refactored FastAPI App',
     description="Это приложение демонстрирует модульную архитектуру с аутентификацией, WebSocket и фоновыми задачами.",
     version='2.0.0',
-    lifespan=lifespan 
+    lifespan=lifespan,
+    # Ответы сериализует orjson (в разы быстрее стандартного json) — для всех эндпоинтов сразу
+    default_response_class=ORJSONResponse
 )
 
 # Инициализация мониторинга (Prometheus)
@@ -200,30 +231,69 @@ app.add_middleware(
 )
 
 
-@app.middleware('http')
-async def add_process_time_header(request: Request, call_next):
-    # 1. Засекаем время ДО начала обработки
-    start_time = time.time()
+class ProcessTimeMiddleware:
+    """
+    Заголовок X-Process-Time — время обработки запроса в секундах.
+    Чистый ASGI-middleware: в отличие от @app.middleware('http') (BaseHTTPMiddleware)
+    не создает на каждый запрос Request, отдельную задачу и поток для тела ответа.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        # WebSocket и lifespan, а также статику (/static/* и index.html на "/") не замеряем
+        path = scope.get('path', '')
+        if scope['type'] != 'http' or path == '/' or path.startswith('/static/'):
+            await self.app(scope, receive, send)
+            return
+
+        # 1. Засекаем время ДО начала обработки (монотонные часы в наносекундах, без float)
+        start_ns = time.perf_counter_ns()
 
-    # 2. Передаем запрос дальше (в другие middleware и в твою ручку)
-    response = await call_next(request)
+        async def send_with_process_time(message):
+            # 2. Ответ начинается: замеряем время и дописываем заголовок (время в секундах, точность до микросекунды)
+            if message['type'] == 'http.response.start':
+                process_ns = time.perf_counter_ns() - start_ns
+                MutableHeaders(scope=message).append('X-Process-Time', f'{process_ns * 1e-9:.6f}')
+            await send(message)
 
-    # 3. Замеряем время ПОСЛЕ
-    process_time = time.time() - start_time
+        await self.app(scope, receive, send_with_process_time)
 
-    # 4. Добавляем заголовок в ответ (время в секундах)
-    response.headers['X-Process-Time'] = str(process_time)
 
-    return response
+app.add_middleware(ProcessTimeMiddleware)
+
+
+# Сколько браузер может держать статику у себя, не спрашивая сервер
+STATIC_CACHE_CONTROL = 'public, max-age=3600'
+
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles с заголовком Cache-Control на каждом отданном файле."""
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers.setdefault('Cache-Control', STATIC_CACHE_CONTROL)
+        return response
 
 
 # Подключаем папку static, чтобы браузер мог брать оттуда script.js и стили
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.mount("/static", CachedStaticFiles(directory="static"), name="static")
 
 
 # --- ПОДКЛЮЧАЕМ GRAPHQL ---
-# Создаем роутер, передавая ему схему
-graphql_app = GraphQLRouter(schema)
+class ORJSONGraphQLRouter(GraphQLRouter):
+    """
+    GraphQL-ответы кодируем orjson, как и остальные ответы приложения (ORJSONResponse).
+    Strawberry по умолчанию зовет json.dumps; байты от orjson он отдает в Response как есть.
+    """
+
+    def encode_json(self, data: object) -> bytes:
+        return orjson.dumps(data)
+
+
+# Создаем роутер, передавая ему схему и контекст (в нем DataLoader'ы на каждый запрос)
+graphql_app = ORJSONGraphQLRouter(schema, context_getter=get_context)
 
 # Подключаем его к приложению
 # prefix="/graphql" означает, что он будет доступен по адресу http://сайт/graphql
@@ -236,12 +306,11 @@ app.include_router(graphql_app, prefix='/graphql')
 # Используем app.include_router(), чтобы подключить все эндпоинты из наших модулей.
 # FastAPI автоматически обработает префиксы (например, /auth, /compute), которые мы задали в каждом роутере.
 
-# 1. Сначала импортируем роутеры (всегда)
+# 1. Роутеры импортированы в начале модуля
 
 # Подключаем только необходимые роутеры для тестов
 # bg_tasks пока можно оставить под условием, если не нужно их тестировать
-if os.getenv('TESTING') != 'True':
-    from bg_tasks import router as tasks_router
+if not TESTING:
     app.include_router(tasks_router)
 
 # 2. Подключаем основные роутеры (ВСЕГДА)
@@ -252,9 +321,12 @@ app.include_router(media.router)
 app.include_router(users.router)
 app.include_router(payments.router)
 
-# --- 5. Корневой эндпоинт (опционально) ---
-# Изменяем главный маршрут: теперь он отдает HTML-файл, а не редирект
+# --- 5. Корневой эндпоинт ---
+# Главная страница — отдельный маршрут, а не статика, смонтированная в "/": такой mount ловил бы
+# любые пути, и неизвестные адреса API получали бы ответ StaticFiles вместо JSON 404,
+# а POST /products — 405 вместо редиректа на /products/.
+# Кэшируется index.html так же, как файлы из /static.
 @app.get('/')
 async def root():
-    return FileResponse('static/index.html')
+    return FileResponse('static/index.html', headers={'Cache-Control': STATIC_CACHE_CONTROL})
 
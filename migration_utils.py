@@ -0,0 +1,37 @@
+# Помощники для миграций Alembic, которые наполняют таблицы данными.
+# Лежит в корне проекта: alembic.ini (prepend_sys_path = .) делает его доступным
+# в файлах миграций как `from migration_utils import bulk_insert, copy_records`.
+from typing import Iterable, Sequence
+
+from alembic import context, op
+from sqlalchemy import Table
+from sqlalchemy.util import await_only
+
+
+def bulk_insert(table: Table, rows: Iterable[dict], batch_size: int = 1000) -> None:
+    """
+    Вставляет строки пачками по batch_size: один INSERT на пачку вместо запроса на каждую строку.
+    Вся миграция и так идет в одной транзакции, поэтому коммитить между пачками не нужно.
+    """
+    batch: list[dict] = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            op.bulk_insert(table, batch)
+            batch = []
+    if batch:
+        op.bulk_insert(table, batch)
+
+
+def copy_records(table_name: str, columns: Sequence[str], records: Iterable[tuple]) -> None:
+    """
+    Для больших объемов: загружает записи через COPY (asyncpg copy_records_to_table).
+    Это на порядок быстрее INSERT, но работает только в online-режиме.
+    """
+    if context.is_offline_mode():
+        raise RuntimeError("COPY недоступен при генерации SQL (--sql): используйте bulk_insert")
+
+    # Миграции выполняются внутри connection.run_sync, поэтому асинхронный метод драйвера
+    # вызываем через await_only — так же SQLAlchemy сама работает с asyncpg
+    driver_connection = op.get_bind().connection.driver_connection
+    await_only(driver_connection.copy_records_to_table(table_name, records=records, columns=list(columns)))
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Index
 from sqlalchemy.orm import DeclarativeBase
 
 # Это базовый класс для всех моделей
@@ -14,6 +14,12 @@ class User(Base):
     username = Column(String, unique=True, nullable=False)
     hashed_password = Column(String, nullable=False)
     avatar_url = Column(String, nullable=True)
+
+    # Hash-индекс для поиска по username = $1 (логин и проверка токена).
+    # Первичный ключ уже целочисленный, а unique-ограничение на username нужно для ON CONFLICT и FK.
+    __table_args__ = (
+        Index('ix_users_username_hash', 'username', postgresql_using='hash'),
+    )
     
 
 # --- Модель таблицы Products ---
@@ -27,8 +33,9 @@ class Product(Base):
     price = Column(Integer, nullable=False)
     is_active = Column(Boolean, default=True, server_default='true')
 
-    # Связь с юзером (внешний ключ)
-    owner_username = Column(String, ForeignKey('users.username'), nullable=False)
+    # Связь с юзером (внешний ключ). Индекс: список товаров пользователя ищется по owner_username,
+    # а Postgres сам не индексирует ссылающуюся сторону FK
+    owner_username = Column(String, ForeignKey('users.username'), nullable=False, index=True)
 
 
 # --- Модель таблицы Calculations (для фоновых задач) ---
@@ -36,6 +43,8 @@ class Calculation(Base):
     __tablename__ = 'calculations'
 
     id = Column(Integer, primary_key=True, index=True)
-    username = Column(String, ForeignKey('users.username'), nullable=False)
+    # Индекс по внешнему ключу: без него выборка расчетов пользователя и проверка FK
+    # при удалении/переименовании пользователя сканируют всю таблицу
+    username = Column(String, ForeignKey('users.username'), nullable=False, index=True)
     task = Column(String, nullable=False)   
     result = Column(String, nullable=False)
\ No newline at end of file
@@ -5,69 +5,64 @@ class ProductRepository:
     Класс, который отвечает ТОЛЬКО за работу с базой данных (SQL).
     Никакой проверки прав, никакого Redis здесь быть не должно.
     """
+    # Каждый метод — один запрос, поэтому вызываем его прямо на пуле: pool.fetch/fetchrow/execute
+    # сами берут соединение и возвращают его, без отдельного async with pool.acquire()
     def __init__(self, pool: asyncpg.Pool):
         self.pool = pool
 
     async def get_all_products(self, limit: int, offset: int):
-        async with self.pool.acquire() as conn:
-            records = await conn.fetch(
-                "SELECT * FROM products LIMIT $1 OFFSET $2",
-                limit, offset
-            )
-            return [dict(p) for p in records]
+        records = await self.pool.fetch(
+            "SELECT * FROM products LIMIT $1 OFFSET $2",
+            limit, offset
+        )
+        return [dict(p) for p in records]
 
     async def get_all_by_user(self, username: str, limit: int, offset: int):
-        async with self.pool.acquire() as conn:
-            records = await conn.fetch(
-                "SELECT id, name, price, owner_username FROM products WHERE owner_username = $1 LIMIT $2 OFFSET $3",
-                username, limit, offset 
-            )
-            return [dict(p) for p in records]
+        records = await self.pool.fetch(
+            "SELECT id, name, price, owner_username FROM products WHERE owner_username = $1 LIMIT $2 OFFSET $3",
+            username, limit, offset 
+        )
+        return [dict(p) for p in records]
         
     async def create(self, name: str, price: float, username: str):
-        async with self.pool.acquire() as conn:
-            record = await conn.fetchrow(
-                "INSERT INTO products (name, price, owner_username) VALUES ($1, $2, $3 ) RETURNING *",
-                name, price, username
-            )
-            return dict(record) if record else None
+        record = await self.pool.fetchrow(
+            "INSERT INTO products (name, price, owner_username) VALUES ($1, $2, $3 ) RETURNING *",
+            name, price, username
+        )
+        return dict(record) if record else None
         
     
     async def get_by_id(self, product_id: int):
-        async with self.pool.acquire() as conn:
-            record = await conn.fetchrow(
-                "SELECT * FROM products WHERE id = $1",
-                product_id
-            )
-            return dict(record) if record else None
+        record = await self.pool.fetchrow(
+            "SELECT * FROM products WHERE id = $1",
+            product_id
+        )
+        return dict(record) if record else None
         
     async def delete(self, product_id: int):
-        async with self.pool.acquire() as conn:
-            await conn.execute("DELETE FROM products WHERE id = $1", product_id)
+        await self.pool.execute("DELETE FROM products WHERE id = $1", product_id)
 
     async def update(self, product_id: int, name: str | None, price: float | None):
-        async with self.pool.acquire() as conn:
-            record = await conn.fetchrow(
-                '''
-                UPDATE products
-                SET name = COALESCE($1, name),
-                    price = COALESCE($2, price)
-                WHERE id = $3
-                RETURNING * 
-                ''',
-                name, price, product_id
-            )
-            return dict(record) if record else None
+        record = await self.pool.fetchrow(
+            '''
+            UPDATE products
+            SET name = COALESCE($1, name),
+                price = COALESCE($2, price)
+            WHERE id = $3
+            RETURNING * 
+            ''',
+            name, price, product_id
+        )
+        return dict(record) if record else None
         
     
     async def transfer_product_ownership(self, username: str, product_id: int):
-        async with self.pool.acquire() as conn:
-            record = await conn.fetchrow(
-                '''UPDATE products
-                SET owner_username = $1
-                WHERE id = $2
-                RETURNING * 
-                ''',
-                username, product_id
-                )
-            return (dict(record) if record else None)
\ No newline at end of file
+        record = await self.pool.fetchrow(
+            '''UPDATE products
+            SET owner_username = $1
+            WHERE id = $2
+            RETURNING * 
+            ''',
+            username, product_id
+            )
+        return (dict(record) if record else None)
\ No newline at end of file
@@ -1,5 +1,6 @@
+import logging
 from fastapi import APIRouter, Depends, HTTPException, Request, Header
-from sqlalchemy.ext.asyncio import AsyncSession
+import asyncpg
 from database import get_pool
 from auth import get_current_user
 from repositories.product_repository import ProductRepository
@@ -12,12 +13,13 @@ from websocket import manager
 from bg_tasks import send_email_to_user_task
 
 router = APIRouter(prefix='/payment', tags=['Платежи'])
+logger = logging.getLogger(__name__)
 
 @router.post('/checkout/{product_id}')
 async def buy_products(
     product_id: int,
     current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_pool)
+    db: asyncpg.Pool = Depends(get_pool)
 ):
     # 1. Инициализируем репозиторий
     product_repo = ProductRepository(db)
@@ -42,7 +44,7 @@ async def buy_products(
 async def stripe_webhook(
     request: Request, 
     stripe_signature: str = Header(None), 
-    db: AsyncSession = Depends(get_pool)
+    db: asyncpg.Pool = Depends(get_pool)
 ):
     # Инициализируем сервис
     product_repo = ProductRepository(db)
@@ -65,8 +67,8 @@ async def stripe_webhook(
     if event['type'] == 'checkout.session.completed':
         session = event['data']['object']
 
-        print("🔍 ДАННЫЕ СЕССИИ ОТ STRIPE:")
-        print(session)
+        # В сессии email и адрес покупателя — в обычный вывод ее не пишем
+        logger.debug("🔍 ДАННЫЕ СЕССИИ ОТ STRIPE: %s", session)
 
         metadata = session['metadata']
 
@@ -1,7 +1,7 @@
 from fastapi import APIRouter, UploadFile, File, Depends, HTTPException
 from s3_service import s3_client
-from auth import get_current_user
-from database import get_pool
+from auth import get_current_user, invalidate_user_cache
+from database import get_pool, get_redis
 
 router = APIRouter(tags=['Users'])
 
@@ -9,7 +9,8 @@ router = APIRouter(tags=['Users'])
 async def update_avatar(
     file: UploadFile = File(...),
     current_user: dict = Depends(get_current_user), # Требуем, чтобы пользователь был залогинен
-    pool = Depends(get_pool) #  Подключаемся к базе
+    pool = Depends(get_pool), #  Подключаемся к базе
+    redis = Depends(get_redis) # ... и к Redis, где лежит общий кэш профилей
 ):
     # 1. Проверяем формат файла (только картинки)
     if not file.content_type or not file.content_type.startswith('image/'):
@@ -31,12 +32,13 @@ async def update_avatar(
     
     # 3. Записываем ссылку в базу данных
     # Используем $1, $2 для защиты от SQL-инъекций
-    async with pool.acquire() as conn:
-        await conn.execute(
-            "UPDATE users SET avatar_url = $1 WHERE username = $2",
-            avatar_url,
-            username
-        )
+    await pool.execute(
+        "UPDATE users SET avatar_url = $1 WHERE username = $2",
+        avatar_url,
+        username
+    )
+    # Сбрасываем кэш аутентификации, чтобы /auth/me сразу отдал новую аватарку
+    await invalidate_user_cache(username, redis)
 
     return {
         "message": "Avatar updated successfully",
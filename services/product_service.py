@@ -1,10 +1,31 @@
+import logging
+from decimal import Decimal
+import orjson
 from fastapi import HTTPException
-from fastapi.encoders import jsonable_encoder
-import json
+from fastapi.encoders import decimal_encoder
 
 # Импортируем наш репозиторий
 from repositories.product_repository import ProductRepository
 
+logger = logging.getLogger(__name__)
+
+# Общий список товаров для GraphQL (query { products }) кэшируется одним ключом (hash, поле на страницу).
+# Сбрасывается при любом изменении товаров — и из GraphQL, и из REST (см. _clear_cache)
+GRAPHQL_PRODUCTS_CACHE_KEY = "graphql:products"
+GRAPHQL_PRODUCTS_CACHE_TTL = 30
+
+def _json_default(obj):
+    # orjson сам сериализует числа, строки и даты; NUMERIC-цены (Decimal) переводим как FastAPI
+    if isinstance(obj, Decimal):
+        return decimal_encoder(obj)
+    raise TypeError
+
+
+def _dumps(data) -> bytes:
+    """JSON товаров для кэша и уведомлений: orjson (C) вместо jsonable_encoder + json.dumps."""
+    return orjson.dumps(data, default=_json_default)
+
+
 class ProductService:
     def __init__(self, repository: ProductRepository, redis=None, background_tasks=None, manager=None):
         self.repo = repository
@@ -17,9 +38,9 @@ class ProductService:
         if self.redis:
             try:
                 cached_keys = await self.redis.keys(f"products:{username}:*")
-                if cached_keys:
-                    await self.redis.delete(*cached_keys)
-                    print(f"🧹 Кэш сброшен для пользователя {username}")
+                # Вместе с кэшем пользователя сбрасываем и общий список товаров GraphQL
+                await self.redis.delete(GRAPHQL_PRODUCTS_CACHE_KEY, *cached_keys)
+                logger.debug("🧹 Кэш сброшен для пользователя %s", username)
             except Exception as e:
                 print(f"⚠️ Ошибка сброса кэша: {e}")
 
@@ -38,24 +59,24 @@ class ProductService:
             try:
                 cached_data = await self.redis.get(CACHE_KEY)
                 if cached_data:
-                    print(f"✅ CACHE HIT: Товары для пользователя {username} из Redis")
-                    return json.loads(cached_data)
+                    logger.debug("✅ CACHE HIT: Товары для пользователя %s из Redis", username)
+                    return orjson.loads(cached_data)
             except Exception:
                 pass # Игнорируем ошибку чтения и идем в БД
 
         # 2. Идем в базу через Репозиторий!
-        print(f"❌ CACHE MISS: Идем в базу за товарами для {username}")
+        logger.debug("❌ CACHE MISS: Идем в базу за товарами для %s", username)
+        # Записи отдаем как есть: в ответ их сериализует response_model эндпоинта
         records = await self.repo.get_all_by_user(username, limit, offset)
-        products_data = jsonable_encoder(records)
         
         # 3. Сохраняем в кэш
         if self.redis:
             try:
-                await self.redis.set(CACHE_KEY, json.dumps(products_data), ex=60)
+                await self.redis.set(CACHE_KEY, _dumps(records), ex=60)
             except Exception:
                 pass
 
-        return products_data
+        return records
 
 
     async def get_product_by_id(self, product_id: int):
@@ -74,7 +95,7 @@ class ProductService:
         if self.background_tasks and self.manager:
             self.background_tasks.add_task(
                 self.manager.broadcast,
-                f"Новый продукт {json.dumps(jsonable_encoder(new_product))}"
+                f"Новый продукт {_dumps(new_product).decode()}"
             )
 
         # 3 Сбрасываем кеш
@@ -117,7 +138,7 @@ class ProductService:
         if self.background_tasks and self.manager:
             self.background_tasks.add_task(
                 self.manager.broadcast,
-                    f"Продукт {json.dumps(jsonable_encoder(updated_product))} был обновлен"
+                    f"Продукт {_dumps(updated_product).decode()} был обновлен"
             )
         await self._clear_cache(username)
 
@@ -8,6 +8,7 @@ from fastapi.testclient import TestClient
 import os
 from starlette import status
 from websocket import manager
+import auth
 from httpx import AsyncClient, ASGITransport
 
 
@@ -55,6 +56,10 @@ def db_pool(monkeypatch):
     fake_products_db.clear()
     fake_product_id_counter = 1
     manager.active_connections = {}
+    # Кэши auth живут на уровне модуля — чистим, чтобы тесты не видели чужих пользователей
+    auth._auth_cache.clear()
+    auth._user_cache.clear()
+    auth._verify_cache.clear()
 
     # --- ОПРЕДЕЛЕНИЕ ФЕЙКОВЫХ ФУНКЦИЙ ---
 
@@ -65,8 +70,8 @@ def db_pool(monkeypatch):
             return {'username': username, 'hashed_password': 'hashed_password'}
         return None
     
-    # Эта "обманка" будет имитировать проверку пароля
-    def mock_verify_password(plain_password, hashed_password):
+    # Эта "обманка" будет имитировать проверку пароля (асинхронно, как и настоящая)
+    async def mock_verify_password(plain_password, hashed_password):
         return hashed_password == "hashed_password" and plain_password == 'strongpassword123'
 
     # Вспомогательная функция для выполнения INSERT в "памяти"
@@ -96,6 +101,14 @@ def db_pool(monkeypatch):
                     print(f"TESTING mode: Продукт '{new_product['name']}' добавлен в mock DB.")
                     return new_product
                 
+                # 1.1 Регистрация пользователя (INSERT ... ON CONFLICT DO NOTHING RETURNING username)
+                if "INSERT INTO users" in query:
+                    if args[0] in existing_users:
+                        return None # Имя занято: ON CONFLICT ничего не вставил
+                    existing_users.add(args[0])
+                    print(f"!!! УСПЕХ: User '{args[0]}' добавлен в mock DB.")
+                    return {'username': args[0]}
+
                 # 2. Поиск пользователя (для логина)
                 if "SELECT" in query and "users" in query:
                     if args and args[0] in existing_users:
@@ -195,6 +208,20 @@ def db_pool(monkeypatch):
         class MockPool:
             def acquire(self):
                 return MockConnection()
+
+            # Как и asyncpg.Pool, умеет выполнять запрос сам, без явного acquire()
+            async def fetchrow(self, query, *args):
+                return await MockConnection().fetchrow(query, *args)
+
+            async def fetchval(self, query, *args):
+                row = await MockConnection().fetchrow(query, *args)
+                return next(iter(row.values())) if row else None
+
+            async def fetch(self, query, *args):
+                return await MockConnection().fetch(query, *args)
+
+            async def execute(self, query, *args):
+                return await MockConnection().execute(query, *args)
             
             async def __aenter__(self):
                 return self
@@ -227,6 +254,7 @@ def db_pool(monkeypatch):
     try:
         # "Подменяем" настоящую функцию проверки пароля на нашу "обманку"
         monkeypatch.setattr('auth.get_user_from_db', mock_get_user_from_db)
+        monkeypatch.setattr('auth.get_user_profile', mock_get_user_from_db)
         monkeypatch.setattr('auth.verify_password', mock_verify_password)
     except AttributeError:
         pass
@@ -313,4 +341,69 @@ async def ac(db_pool):
 
     transport = ASGITransport(app=app)
     async with AsyncClient(transport=transport, base_url="http://test") as ac:
-        yield ac
\ No newline at end of file
+        yield ac
+
+
+# --- 3. Фейки для юнит-тестов, которым не нужно все приложение ---
+
+class FakeRedis:
+    """Минимальный асинхронный Redis в памяти: get/set/setex с временем жизни, exists, delete и getdel."""
+
+    def __init__(self):
+        self.data = {}
+
+    async def set(self, key, value, ex=None):
+        self.data[key] = (value, ex)
+
+    async def setex(self, key, ttl, value):
+        self.data[key] = (value, ttl)
+
+    async def exists(self, key):
+        return int(key in self.data)
+
+    async def getdel(self, key):
+        entry = self.data.pop(key, None)
+        return entry[0] if entry else None
+
+    async def get(self, key):
+        entry = self.data.get(key)
+        return entry[0] if entry else None
+
+    async def delete(self, key):
+        return int(self.data.pop(key, None) is not None)
+
+
+@pytest.fixture
+def fake_redis():
+    """Пустой FakeRedis на каждый тест."""
+    return FakeRedis()
+
+
+class RecordingPool:
+    """
+    Пул, который запоминает выполненные запросы в queries: (текст запроса, аргументы).
+    fetchrow отдает профиль пользователя из первого аргумента. Если задан error — любой запрос его выбрасывает.
+    """
+
+    def __init__(self):
+        self.queries = []
+        self.error = None
+
+    def _record(self, query, args):
+        if self.error is not None:
+            raise self.error
+        self.queries.append((query, args))
+
+    async def fetchrow(self, query, *args):
+        self._record(query, args)
+        return {'username': args[0], 'avatar_url': None}
+
+    async def execute(self, query, *args):
+        self._record(query, args)
+        return 'UPDATE 1'
+
+
+@pytest.fixture
+def recording_pool():
+    """Пустой RecordingPool на каждый тест."""
+    return RecordingPool()
@@ -1,5 +1,17 @@
+import asyncio
+import logging
+import time
+import bcrypt
+import jwt
+import pytest
+from argon2 import PasswordHasher
+from jwt import InvalidTokenError
+from types import SimpleNamespace
 from fastapi.testclient import TestClient
-from fastapi import status
+from fastapi import status, BackgroundTasks, HTTPException
+from fastapi.security import HTTPAuthorizationCredentials, OAuth2PasswordRequestForm
+import auth
+from graphql_app.auth import authenticate_user
 
 # --- Тесты для эндпоинта /auth/register ---
 def test_register_user_success(client: TestClient):
@@ -112,3 +124,471 @@ def test_login_wrong_password(client: TestClient):
     data = response_login.json()
     assert "access_token" not in data
     assert "detail" in data
+
+
+@pytest.fixture
+def verify_cache():
+    """Очищает кэш проверок паролей до и после теста, чтобы тесты не влияли друг на друга."""
+    auth._verify_cache.clear()
+    yield auth._verify_cache
+    auth._verify_cache.clear()
+
+
+@pytest.fixture
+def check_calls(monkeypatch):
+    """Подменяет проверку bcrypt счетчиком, чтобы видеть, сколько раз она реально вызывалась."""
+    calls = []
+    original_check = auth._check_password
+
+    def counting_check(plain, hashed_value):
+        calls.append(plain)
+        return original_check(plain, hashed_value)
+
+    monkeypatch.setattr(auth, "_check_password", counting_check)
+    return calls
+
+
+async def test_verify_password_uses_cache(verify_cache, check_calls):
+    """
+    Повторная проверка той же пары (пароль, хеш) берется из кэша,
+    а не пересчитывает bcrypt заново.
+    """
+    hashed = await auth.get_password_hash("cached_password")
+
+    assert await auth.verify_password("cached_password", hashed) is True
+    assert len(check_calls) == 1
+    # В кэше лежит результат, а сам пароль в ключе не хранится
+    assert len(verify_cache) == 1
+    assert all(b"cached_password" not in key for key in verify_cache)
+
+    # Второй вызов отдает результат из кэша, bcrypt не вызывается
+    assert await auth.verify_password("cached_password", hashed) is True
+    assert len(check_calls) == 1
+
+
+async def test_verify_password_does_not_cache_failures(verify_cache, check_calls):
+    """Неверный пароль каждый раз проверяется заново и не занимает место в кэше."""
+    hashed = await auth.get_password_hash("cached_password")
+
+    assert await auth.verify_password("wrong_password", hashed) is False
+    assert await auth.verify_password("wrong_password", hashed) is False
+    assert len(check_calls) == 2
+    assert len(verify_cache) == 0
+
+
+async def test_verify_password_coalesces_concurrent_calls(verify_cache, check_calls):
+    """
+    Одновременные проверки одной и той же пары (пароль, хеш)
+    запускают bcrypt только один раз.
+    """
+    hashed = await auth.get_password_hash("concurrent_password")
+
+    results = await asyncio.gather(
+        *(auth.verify_password("concurrent_password", hashed) for _ in range(5))
+    )
+
+    assert results == [True] * 5
+    assert len(check_calls) == 1
+    assert auth._verify_inflight == {}
+
+
+async def test_verify_password_rejects_malformed_hash(verify_cache):
+    """Строка, которая не является bcrypt-хешем, не роняет логин, а дает False."""
+    assert await auth.verify_password("whatever", "not-a-bcrypt-hash") is False
+
+
+async def test_verify_password_survives_cancelled_caller(verify_cache, check_calls):
+    """
+    Если запрос, запустивший проверку, отменен (клиент отключился),
+    остальные ожидающие получают результат той же проверки без повторного bcrypt.
+    """
+    hashed = await auth.get_password_hash("cancel_password")
+
+    first = asyncio.ensure_future(auth.verify_password("cancel_password", hashed))
+    await asyncio.sleep(0)
+    second = asyncio.ensure_future(auth.verify_password("cancel_password", hashed))
+    await asyncio.sleep(0)
+    first.cancel()
+
+    assert await second is True
+    with pytest.raises(asyncio.CancelledError):
+        await first
+    assert len(check_calls) == 1
+    assert auth._verify_inflight == {}
+    assert len(verify_cache) == 1
+
+
+async def test_verify_password_error_is_not_cached(verify_cache, monkeypatch):
+    """Ошибка внутри проверки доходит до всех ожидающих и не оставляет следов в кэше."""
+    def broken_check(plain, hashed_value):
+        raise RuntimeError("bcrypt failure")
+
+    monkeypatch.setattr(auth, "_check_password", broken_check)
+
+    results = await asyncio.gather(
+        *(auth.verify_password("any_password", "any_hash") for _ in range(3)),
+        return_exceptions=True,
+    )
+
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert auth._verify_inflight == {}
+    assert len(verify_cache) == 0
+
+
+@pytest.fixture
+def fast_hasher(monkeypatch):
+    """Дешевые параметры Argon2id, чтобы тесты не тратили 46 МиБ и десятки миллисекунд на хеш."""
+    monkeypatch.setattr(auth, "_password_hasher", PasswordHasher(time_cost=1, memory_cost=8, parallelism=1))
+
+
+def test_password_needs_rehash(fast_hasher):
+    """bcrypt-хеши и Argon2-хеши с другими параметрами помечаются для пересчета."""
+    current = auth._hash_password("secret")
+
+    assert current.startswith("$argon2id$")
+    assert auth.password_needs_rehash(current) is False
+    assert auth.password_needs_rehash(current.replace("m=8,", "m=16,", 1)) is True
+    assert auth.password_needs_rehash("$2b$10$" + "a" * 53) is True
+    # Не хеш вовсе пересчитывать не пытаемся
+    assert auth.password_needs_rehash("hashed_password") is False
+    assert auth.password_needs_rehash("$argon2id$broken") is False
+
+
+def test_check_password_accepts_argon2_and_legacy_bcrypt(fast_hasher):
+    """Argon2id-хеши проверяются argon2-cffi, старые bcrypt-хеши — как раньше."""
+    argon2_hash = auth._hash_password("secret")
+    bcrypt_hash = bcrypt.hashpw(b"secret", bcrypt.gensalt(4)).decode()
+
+    assert auth._check_password("secret", argon2_hash)
+    assert not auth._check_password("wrong", argon2_hash)
+    assert auth._check_password("secret", bcrypt_hash)
+    assert not auth._check_password("wrong", bcrypt_hash)
+    assert not auth._check_password("secret", "$argon2id$broken")
+
+
+async def test_rehash_password_uses_current_params(fast_hasher, recording_pool):
+    """rehash_password сохраняет в БД новый Argon2id-хеш с текущими параметрами."""
+    await auth.rehash_password(recording_pool, "rehash_user", "secret")
+
+    [(query, (new_hash, username))] = recording_pool.queries
+    assert "UPDATE users SET hashed_password" in query
+    assert username == "rehash_user"
+    assert new_hash.startswith("$argon2id$v=19$m=8,t=1,p=1$")
+    assert auth._check_password("secret", new_hash)
+
+
+async def test_rehash_password_keeps_old_hash_on_db_error(fast_hasher, recording_pool, caplog):
+    """Ошибка БД при пересчете хеша не пробрасывается из фоновой задачи."""
+    recording_pool.error = ConnectionError("db down")
+
+    await auth.rehash_password(recording_pool, "rehash_user", "secret")
+
+    assert "db down" in caplog.text
+
+
+async def test_login_rehashes_in_background(monkeypatch):
+    """Логин со старым bcrypt-хешем отвечает сразу, а пересчет в Argon2id ставит в фоновые задачи."""
+    old_hash = bcrypt.hashpw(b"secret", bcrypt.gensalt(4)).decode()
+
+    async def fake_get_user_from_db(pool, username):
+        return {'username': username, 'hashed_password': old_hash}
+
+    async def fake_verify_password(plain_password, hashed_password):
+        return True
+
+    monkeypatch.setattr(auth, "get_user_from_db", fake_get_user_from_db)
+    monkeypatch.setattr(auth, "verify_password", fake_verify_password)
+
+    background_tasks = BackgroundTasks()
+    form = OAuth2PasswordRequestForm(username="old_cost_user", password="secret")
+    tokens = await auth.login_for_token(background_tasks, form, None, None)
+
+    assert auth.decode_token(tokens['access_token'])['sub'] == "old_cost_user"
+    [task] = background_tasks.tasks
+    assert task.func is auth.rehash_password
+    assert task.args == (None, "old_cost_user", "secret", None)
+
+
+def test_benchmark_password_hash_warns_when_slow(fast_hasher, monkeypatch, caplog):
+    """При слишком медленном хеше пароля старт приложения пишет в лог предупреждение."""
+    monkeypatch.setattr(auth, "PASSWORD_HASH_SLOW_THRESHOLD_MS", -1)
+
+    with caplog.at_level(logging.INFO, logger="auth"):
+        elapsed_ms = auth.benchmark_password_hash()
+
+    assert elapsed_ms >= 0
+    [info, warning] = caplog.records
+    assert info.levelno == logging.INFO and "argon2id: t=1" in info.getMessage()
+    assert warning.levelno == logging.WARNING and "уменьшите ARGON2_TIME_COST" in warning.getMessage()
+
+
+@pytest.fixture
+def auth_cache():
+    """Очищает кэши аутентификации (по токену и по имени) до и после теста."""
+    auth._auth_cache.clear()
+    auth._user_cache.clear()
+    yield auth._auth_cache
+    auth._auth_cache.clear()
+    auth._user_cache.clear()
+
+
+@pytest.fixture
+def db_lookups(monkeypatch):
+    """Подменяет get_user_profile и считает, сколько раз реально ходили в БД."""
+    calls = []
+
+    async def fake_get_user_profile(pool, username):
+        calls.append(username)
+        return {'username': username, 'avatar_url': 'avatar.png'}
+
+    monkeypatch.setattr(auth, "get_user_profile", fake_get_user_profile)
+    return calls
+
+
+def _bearer(token: str):
+    return HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+
+
+async def test_get_current_user_caches_user_by_token(auth_cache, db_lookups):
+    """Повторные запросы с тем же токеном не ходят в БД и получают независимую копию пользователя."""
+    token = auth.create_tokens({'sub': 'cached_user'})['access_token']
+
+    users = await asyncio.gather(*(auth.get_current_user(_bearer(token), None, None) for _ in range(3)))
+    again = await auth.get_current_user(_bearer(token), None, None)
+
+    assert db_lookups == ['cached_user']
+    assert all(user['username'] == 'cached_user' for user in users)
+    # /me подменяет avatar_url в полученном словаре — кэш от этого не должен меняться
+    again['avatar_url'] = 'https://presigned'
+    assert (await auth.get_current_user(_bearer(token), None, None))['avatar_url'] == 'avatar.png'
+
+
+async def test_get_current_user_rejects_bad_token_without_caching(auth_cache, db_lookups):
+    """Невалидный токен дает 401 и не попадает в кэш."""
+    with pytest.raises(HTTPException) as exc_info:
+        await auth.get_current_user(_bearer("not-a-jwt"), None, None)
+
+    assert exc_info.value.status_code == status.HTTP_401_UNAUTHORIZED
+    assert len(auth_cache) == 0
+    assert auth._auth_inflight == {}
+
+
+async def test_invalidate_user_cache(auth_cache, db_lookups):
+    """После смены данных пользователя следующий запрос снова идет в БД."""
+    token = auth.create_tokens({'sub': 'avatar_user'})['access_token']
+
+    await auth.get_current_user(_bearer(token), None, None)
+    await auth.invalidate_user_cache('avatar_user')
+    await auth.get_current_user(_bearer(token), None, None)
+
+    assert db_lookups == ['avatar_user', 'avatar_user']
+
+
+async def test_new_token_of_cached_user_skips_db(auth_cache, db_lookups):
+    """Второй токен того же пользователя берет профиль из кэша профилей, а не из БД."""
+    first = auth.create_tokens({'sub': 'two_devices'})['access_token']
+    second = auth.create_tokens({'sub': 'two_devices'})['access_token']
+
+    await auth.get_current_user(_bearer(first), None, None)
+    user = await auth.get_current_user(_bearer(second), None, None)
+
+    assert user['username'] == 'two_devices'
+    assert db_lookups == ['two_devices']
+
+
+async def test_get_current_user_ignores_expired_cache_entry(auth_cache, db_lookups):
+    """Запись кэша с истекшим exp не используется."""
+    token = auth.create_tokens({'sub': 'expired_user'})['access_token']
+    auth_cache[auth._token_key(token)] = ({'username': 'expired_user'}, 0, None)
+
+    user = await auth.get_current_user(_bearer(token), None, None)
+
+    assert user['avatar_url'] == 'avatar.png'
+    assert db_lookups == ['expired_user']
+
+
+def test_auth_cache_entry_lives_until_token_exp(auth_cache):
+    """Запись живет AUTH_CACHE_TTL секунд, но не дольше exp токена; ключ — хеш, а не сам токен."""
+    now = time.time()
+    assert auth._auth_cache_expires(b'k', ({}, now + 10, None), now) == now + 10
+    assert auth._auth_cache_expires(b'k', ({}, now + 3600, None), now) == now + auth.AUTH_CACHE_TTL
+
+    token = auth.create_tokens({'sub': 'hashed_user'})['access_token']
+    auth_cache[auth._token_key(token)] = ({'username': 'hashed_user'}, int(now) + 600, None)
+    assert token not in auth_cache
+    assert len(auth._token_key(token)) == 32
+
+
+async def test_get_user_profile_does_not_select_password_hash(recording_pool):
+    """Профиль для проверки токена запрашивается без hashed_password."""
+    user = await auth.get_user_profile(recording_pool, 'profile_user')
+
+    assert user == {'username': 'profile_user', 'avatar_url': None}
+    [(query, _)] = recording_pool.queries
+    assert 'hashed_password' not in query
+
+
+def test_create_tokens_are_compatible_with_plain_secret():
+    """Токены, подписанные заранее собранным ключом, проверяются обычным SECRET_KEY стандартным PyJWT."""
+    tokens = auth.create_tokens({'sub': 'signer_user'})
+
+    access = jwt.decode(tokens['access_token'], auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
+    refresh = jwt.decode(tokens['refresh_token'], auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
+
+    assert access['sub'] == refresh['sub'] == 'signer_user'
+    assert (access['type'], refresh['type']) == ('access', 'refresh')
+    assert refresh['exp'] - access['exp'] == auth.REFRESH_TTL - auth.ACCESS_TTL
+
+
+
+async def test_graphql_authenticate_user_accepts_only_access_tokens(fake_redis):
+    """GraphQL проверяет Bearer-токен общей decode_access_token: access проходит, refresh, чужая схема и отозванный — нет."""
+    tokens = auth.create_tokens({'sub': 'graphql_user'})
+    revoked = auth.create_tokens({'sub': 'graphql_user'})['access_token']
+    payload = auth.decode_token(revoked)
+    await auth.revoke_token(fake_redis, payload['jti'], payload['exp'])
+
+    def request(header):
+        return SimpleNamespace(headers={'Authorization': header})
+
+    assert await authenticate_user(request(f"Bearer {tokens['access_token']}"), fake_redis) == 'graphql_user'
+    for header in (f"Bearer {tokens['refresh_token']}", f"Basic {tokens['access_token']}", 'Bearer garbage',
+                   f"Bearer {revoked}"):
+        with pytest.raises(Exception, match='Could not validate credentials'):
+            await authenticate_user(request(header), fake_redis)
+
+
+async def test_decode_access_token_rejects_refresh_and_revoked_tokens(fake_redis):
+    """decode_access_token — общая проверка для WebSocket и GraphQL: только действующий access токен."""
+    tokens = auth.create_tokens({'sub': 'access_user'})
+    assert (await auth.decode_access_token(tokens['access_token'], fake_redis))['sub'] == 'access_user'
+
+    with pytest.raises(InvalidTokenError):
+        await auth.decode_access_token(tokens['refresh_token'], fake_redis)
+
+    payload = auth.decode_token(tokens['access_token'])
+    await auth.revoke_token(fake_redis, payload['jti'], payload['exp'])
+    with pytest.raises(InvalidTokenError):
+        await auth.decode_access_token(tokens['access_token'], fake_redis)
+
+
+async def test_revoked_token_is_rejected_even_when_cached(auth_cache, db_lookups, fake_redis):
+    """После отзыва токен отклоняется, хотя пользователь уже лежит в кэше."""
+    token = auth.create_tokens({'sub': 'logout_user'})['access_token']
+    payload = jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
+
+    assert (await auth.get_current_user(_bearer(token), None, fake_redis))['username'] == 'logout_user'
+
+    await auth.revoke_token(fake_redis, payload['jti'], payload['exp'])
+
+    # Ключ живет ровно столько, сколько осталось жить токену
+    _, ttl = fake_redis.data[auth.REVOKED_KEY_PREFIX + payload['jti']]
+    assert 0 < ttl <= auth.ACCESS_TTL
+    with pytest.raises(HTTPException):
+        await auth.get_current_user(_bearer(token), None, fake_redis)
+
+
+async def test_refresh_token_is_stored_and_rotated(fake_redis):
+    """Refresh токен лежит в Redis до exp, обменивается на новую пару один раз и только как refresh."""
+    tokens = await auth.issue_tokens(fake_redis, 'refresh_user')
+
+    [(key, (digest, ttl))] = fake_redis.data.items()
+    assert key.startswith(auth.REFRESH_KEY_PREFIX + 'refresh_user:')
+    assert ttl == auth.REFRESH_TTL
+    assert tokens['refresh_token'] not in digest
+
+    new_tokens = await auth.refresh_tokens(auth.RefreshRequest(refresh_token=tokens['refresh_token']), fake_redis)
+    assert auth.decode_token(new_tokens['access_token'])['sub'] == 'refresh_user'
+
+    # Старый refresh токен уже погашен, а access токен вместо refresh не принимается
+    for bad_token in (tokens['refresh_token'], new_tokens['access_token']):
+        with pytest.raises(HTTPException) as exc_info:
+            await auth.refresh_tokens(auth.RefreshRequest(refresh_token=bad_token), fake_redis)
+        assert exc_info.value.status_code == status.HTTP_401_UNAUTHORIZED
+
+    # Новый refresh токен по-прежнему действует
+    assert await auth.consume_refresh_token(fake_redis, new_tokens['refresh_token']) == 'refresh_user'
+
+
+async def test_refresh_fails_after_logout(auth_cache, db_lookups, fake_redis):
+    """Выход гасит и refresh токен своей пары: /auth/refresh после logout отвечает 401, другие сессии живут."""
+    tokens = await auth.issue_tokens(fake_redis, 'logout_refresh_user')
+    other_device = await auth.issue_tokens(fake_redis, 'logout_refresh_user')
+    access = tokens['access_token']
+
+    user = await auth.get_current_user(_bearer(access), None, fake_redis)
+    await auth.logout(_bearer(access), user, fake_redis)
+
+    with pytest.raises(HTTPException) as exc_info:
+        await auth.refresh_tokens(auth.RefreshRequest(refresh_token=tokens['refresh_token']), fake_redis)
+    assert exc_info.value.status_code == status.HTTP_401_UNAUTHORIZED
+    with pytest.raises(HTTPException):
+        await auth.get_current_user(_bearer(access), None, fake_redis)
+
+    assert await auth.consume_refresh_token(fake_redis, other_device['refresh_token']) == 'logout_refresh_user'
+
+
+async def test_user_profile_is_shared_through_redis(auth_cache, db_lookups, fake_redis):
+    """Профиль, загруженный одним процессом, другой берет из Redis; смена данных сбрасывает и его."""
+    token = auth.create_tokens({'sub': 'shared_user'})['access_token']
+
+    await auth.get_current_user(_bearer(token), None, fake_redis)
+    value, ttl = fake_redis.data[auth.USER_KEY_PREFIX + 'shared_user']
+    assert ttl == auth.USER_REDIS_TTL
+    assert b'hashed_password' not in value
+
+    # "Другой процесс": локальные кэши пусты, а в БД не идем — профиль лежит в Redis
+    auth._auth_cache.clear()
+    auth._user_cache.clear()
+    user = await auth.get_current_user(_bearer(token), None, fake_redis)
+    assert user == {'username': 'shared_user', 'avatar_url': 'avatar.png'}
+    assert db_lookups == ['shared_user']
+
+    await auth.invalidate_user_cache('shared_user', fake_redis)
+    assert auth.USER_KEY_PREFIX + 'shared_user' not in fake_redis.data
+
+
+def test_tokens_have_unique_jti():
+    """Каждый выпущенный токен получает свой jti."""
+    tokens = auth.create_tokens({'sub': 'jti_user'})
+    jtis = {
+        jwt.decode(tokens[name], auth.SECRET_KEY, algorithms=[auth.ALGORITHM])['jti']
+        for name in ('access_token', 'refresh_token')
+    }
+    assert len(jtis) == 2
+
+
+def test_logout(client: TestClient, auth_headers: dict):
+    """Эндпоинт /auth/logout доступен с валидным токеном и без токена отвечает ошибкой."""
+    response = client.post('/auth/logout', headers=auth_headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert "test_user" in response.json()["message"]
+
+    response_anon = client.post('/auth/logout')
+    assert response_anon.status_code in (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN)
+
+
+def test_encode_jwt_matches_library_encoding():
+    """Собранный вручную токен проверяется PyJWT и совпадает с его собственным кодированием."""
+    payload = {'sub': 'quote"user', 'exp': 2_000_000_000, 'type': 'access'}
+    token = auth._encode_jwt(payload)
+
+    assert jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM]) == payload
+    assert token == jwt.encode(payload, auth.SECRET_KEY, algorithm=auth.ALGORITHM)
+
+
+def test_decode_token_checks_signature_and_expiry():
+    """decode_token принимает свои токены и отклоняет чужую подпись и истекший exp."""
+    token = auth.create_tokens({'sub': 'decode_user'})['access_token']
+    assert auth.decode_token(token)['sub'] == 'decode_user'
+
+    forged = jwt.encode({'sub': 'decode_user', 'exp': 2_000_000_000}, 'other_secret', algorithm='HS256')
+    other_alg = jwt.encode({'sub': 'decode_user', 'exp': 2_000_000_000}, auth.SECRET_KEY, algorithm='HS512')
+    expired = auth._encode_jwt({'sub': 'decode_user', 'exp': 1})
+    header, payload, signature = token.split('.')
+    admin_payload = auth._b64url(b'{"sub":"admin","exp":2000000000}').decode()
+    tampered = f"{header}.{admin_payload}.{signature}"
+    bad_padding = f"{header}.{payload}.{signature}!"
+    for bad_token in (forged, other_alg, expired, tampered, bad_padding, 'garbage', 'a.b.c'):
+        with pytest.raises(InvalidTokenError):
+            auth.decode_token(bad_token)
@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import orjson
+from celery_worker import celery_app
+
+# Все задачи проекта живут в одном модуле bg_tasks.py
+PROJECT_TASKS = {'compute_factorial_task', 'compute_sum_range_task', 'send_email_to_user'}
+
+
+def test_celery_registers_each_task_once():
+    """В реестре Celery ровно наши задачи — никаких дублей или лишних копий модуля."""
+    import bg_tasks  # noqa: F401 — импорт регистрирует задачи
+
+    registered = {name for name in celery_app.tasks if not name.startswith('celery.')}
+    assert registered == PROJECT_TASKS
+
+
+def test_email_task_goes_to_io_queue():
+    """Письма уходят в очередь 'io', вычисления — в очередь по умолчанию."""
+    import bg_tasks  # noqa: F401
+
+    router = celery_app.amqp.router
+    assert router.route({}, 'send_email_to_user')['queue'].name == 'io'
+    assert router.route({}, 'compute_factorial_task')['queue'].name == celery_app.conf.task_default_queue
+
+
+def test_compute_tasks_return_results_without_sleeping(monkeypatch):
+    """Задачи считают результат сразу и сохраняют его одной записью."""
+    import bg_tasks
+
+    saved = []
+
+    async def fake_save(username, task, result):
+        saved.append((username, task, result))
+
+    async def fake_publish(username, text):
+        pass
+
+    monkeypatch.setattr(bg_tasks, '_save_calculation', fake_save)
+    monkeypatch.setattr(bg_tasks, '_publish_notification', fake_publish)
+
+    try:
+        assert bg_tasks.compute_factorial_task.apply(kwargs={'username': 'u', 'n': 10}).get() == '3628800'
+        assert bg_tasks.compute_sum_range_task.apply(kwargs={'start': -5, 'end': 100, 'username': 'u'}).get() == 5035
+    finally:
+        # Цикл воркера создан прямо в процессе тестов — закрываем его, как при остановке воркера
+        bg_tasks.close_worker_loop()
+        asyncio.set_event_loop(None)
+    assert saved == [('u', 'factorial of 10', '3628800'), ('u', 'sum from -5 to 100', '5035')]
+
+
+def test_factorial_of_large_n_is_saved_in_full(monkeypatch, caplog):
+    """Факториал больше 4300 цифр сохраняется целиком (str(int) на таком числе упал бы), а в лог — только длина."""
+    import bg_tasks
+
+    saved = []
+
+    async def fake_save(username, task, result):
+        saved.append(result)
+
+    async def fake_publish(username, text):
+        pass
+
+    monkeypatch.setattr(bg_tasks, '_save_calculation', fake_save)
+    monkeypatch.setattr(bg_tasks, '_publish_notification', fake_publish)
+    caplog.set_level(logging.INFO, logger='bg_tasks')
+
+    try:
+        result = bg_tasks.compute_factorial_task.apply(kwargs={'username': 'u', 'n': 3000}).get()
+    finally:
+        bg_tasks.close_worker_loop()
+        asyncio.set_event_loop(None)
+
+    assert result == saved[0]
+    assert len(result) == 9131
+    assert saved[0].startswith('41493596034378540855568670930866')
+    assert '(9131 цифр)' in caplog.text
+    assert result not in caplog.text
+
+
+def test_sum_range_matches_builtin_sum():
+    """Формула Гаусса совпадает с sum(range(...)), в том числе для отрицательных и пустых диапазонов."""
+    import random
+    from bg_tasks import sum_range
+
+    rng = random.Random(42)
+    for _ in range(1000):
+        start = rng.randint(-10_000, 10_000)
+        end = start + rng.randint(-3, 5_000)
+        assert sum_range(start, end) == sum(range(start, end + 1))
+
+    assert sum_range(1, 10**12) == 10**12 * (10**12 + 1) // 2
+
+
+def test_notifications_reuse_one_redis_client(monkeypatch):
+    """Уведомления процесса воркера идут через один клиент Redis, который закрывается вместе с циклом."""
+    import bg_tasks
+
+    class FakeRedis:
+        def __init__(self):
+            self.published = []
+            self.closed = False
+
+        async def publish(self, channel, message):
+            self.published.append((channel, message))
+
+        async def aclose(self):
+            self.closed = True
+
+    clients = []
+
+    def fake_from_url(url):
+        clients.append(FakeRedis())
+        return clients[-1]
+
+    monkeypatch.setattr(bg_tasks.aioredis, 'from_url', fake_from_url)
+
+    try:
+        bg_tasks._run_in_worker_loop(bg_tasks._publish_notification('u', 'first'))
+        bg_tasks._run_in_worker_loop(bg_tasks._publish_notification('u', 'second'))
+    finally:
+        bg_tasks.close_worker_loop()
+        asyncio.set_event_loop(None)
+
+    assert len(clients) == 1
+    assert [channel for channel, _ in clients[0].published] == ['celery_notifications'] * 2
+    # Слушатель в main.py разбирает сообщение обратно в тот же словарь
+    assert orjson.loads(clients[0].published[1][1]) == {'username': 'u', 'message': 'second'}
+    assert clients[0].closed
+
+
+def test_redis_connections_are_pooled():
+    """Брокер и бэкенд результатов работают через пулы соединений с потолком не меньше concurrency IO-воркера."""
+    import celery_worker
+
+    conf = celery_app.conf
+    assert conf.broker_pool_limit == 10
+    assert conf.broker_transport_options['max_connections'] == celery_worker.REDIS_MAX_CONNECTIONS
+    assert conf.broker_transport_options['socket_keepalive'] is True
+    assert conf.redis_max_connections >= 50
+    assert celery_app.backend.connparams['max_connections'] == celery_worker.REDIS_MAX_CONNECTIONS
+
+
+def test_worker_loop_uses_uvloop_when_available():
+    """Цикл процесса воркера — uvloop, если он установлен (под Windows — обычный asyncio)."""
+    import bg_tasks
+
+    bg_tasks.init_worker_loop()
+    try:
+        if bg_tasks.uvloop is not None:
+            assert isinstance(bg_tasks._worker_loop, bg_tasks.uvloop.Loop)
+        assert bg_tasks._run_in_worker_loop(asyncio.sleep(0, result='ok')) == 'ok'
+    finally:
+        bg_tasks.close_worker_loop()
+        asyncio.set_event_loop(None)
+
+
+def test_orjson_serializer_keeps_big_integers():
+    """Сериализатор Celery на orjson не теряет точность на числах больше 64 бит."""
+    from kombu.serialization import dumps, loads
+
+    for body in ({'args': [], 'kwargs': {'start': 1, 'end': 10**12, 'username': 'u'}},
+                 {'result': 10**24, 'status': 'SUCCESS'},
+                 {'result': '3628800' * 10, 'status': 'SUCCESS'},
+                 {'kwargs': {'username': 'пользователь', 'n': 10}}):
+        content_type, encoding, payload = dumps(body, serializer='orjson')
+        assert loads(payload, content_type, encoding) == body
+
+
+def test_only_transient_errors_are_retried(monkeypatch):
+    """Недоступная база ведет к повторам, ошибка в данных — сразу к FAILURE без повторов."""
+    import bg_tasks
+
+    calls = []
+    error = ConnectionRefusedError('db is down')
+
+    async def failing_save(username, task, result):
+        calls.append(task)
+        raise error
+
+    monkeypatch.setattr(bg_tasks, '_save_calculation', failing_save)
+
+    try:
+        # В eager-режиме (apply) Celery выполняет повторы сразу, без задержки
+        transient = bg_tasks.compute_sum_range_task.apply(kwargs={'start': 1, 'end': 10, 'username': 'u'})
+        assert transient.state == 'FAILURE'
+        assert len(calls) == 1 + bg_tasks.TASK_MAX_RETRIES
+
+        calls.clear()
+        error = ValueError('bad data')
+        permanent = bg_tasks.compute_sum_range_task.apply(kwargs={'start': 1, 'end': 10, 'username': 'u'})
+    finally:
+        bg_tasks.close_worker_loop()
+        asyncio.set_event_loop(None)
+
+    assert permanent.state == 'FAILURE'
+    assert isinstance(permanent.result, ValueError)
+    assert len(calls) == 1
+
+
+def test_retry_countdown_is_jittered_exponential_backoff():
+    """Задержка повтора случайная, но не больше 5 * 2**n секунд и общего потолка."""
+    from bg_tasks import RETRY_BACKOFF_MAX_SECONDS, _retry_countdown
+
+    for retries in range(6):
+        ceiling = min(5 * 2 ** retries, RETRY_BACKOFF_MAX_SECONDS)
+        delays = {_retry_countdown(retries) for _ in range(200)}
+        assert all(0 <= delay <= ceiling for delay in delays)
+        assert len(delays) > 1
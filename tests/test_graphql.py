@@ -65,4 +65,249 @@ async def test_create_product_authorized(ac, db_pool, auth_headers): # auth_head
     assert "errors" not in data
     # Товар должен вернуться
     assert data["data"]["addProduct"]["name"] == "Test Item"
-    assert data["data"]["addProduct"]["id"] is not None
\ No newline at end of file
+    assert data["data"]["addProduct"]["id"] is not None
+
+# 4. Несколько product(...) в одном запросе загружаются одним SELECT через DataLoader
+@pytest.mark.asyncio
+async def test_products_by_id_are_batched_into_one_query():
+    from types import SimpleNamespace
+    from graphql_app.schema import schema, get_context
+
+    queries = []
+
+    class FakePool:
+        async def fetch(self, query, ids):
+            queries.append(ids)
+            return [{'id': i, 'name': f'item {i}', 'description': None, 'price': 10 * i} for i in ids if i != 404]
+
+    request = SimpleNamespace(app=SimpleNamespace(state=SimpleNamespace(pool=FakePool())))
+    context = {**await get_context(request), 'request': request}
+
+    result = await schema.execute("""
+    query {
+        first: product(productId: 1) { name price }
+        second: product(productId: 2) { name }
+        again: product(productId: 1) { name }
+        missing: product(productId: 404) { name }
+    }
+    """, context_value=context)
+
+    assert result.errors is None
+    assert result.data == {
+        'first': {'name': 'item 1', 'price': 10},
+        'second': {'name': 'item 2'},
+        'again': {'name': 'item 1'},
+        'missing': None,
+    }
+    # Один запрос к базе на все поля, повторный id берется из кэша загрузчика
+    assert queries == [[1, 2, 404]]
+
+
+# 5. Повторный запрос с тем же текстом не разбирается и не валидируется заново
+@pytest.mark.asyncio
+async def test_repeated_query_skips_parse_and_validation():
+    from strawberry.extensions import ParserCache, ValidationCache
+    from graphql_app.schema import schema
+
+    parser = next(e for e in schema.extensions if isinstance(e, ParserCache))
+    validator = next(e for e in schema.extensions if isinstance(e, ValidationCache))
+    parser.cached_parse_document.cache_clear()
+    validator.cached_validate_document.cache_clear()
+
+    for _ in range(3):
+        result = await schema.execute('query RepeatedHello { hello }')
+        assert result.data == {'hello': 'GraphQL работает!'}
+
+    # Разбор и валидация — по одному разу, два повтора взяты из кэша
+    assert (parser.cached_parse_document.cache_info().misses, parser.cached_parse_document.cache_info().hits) == (1, 2)
+    assert (validator.cached_validate_document.cache_info().misses, validator.cached_validate_document.cache_info().hits) == (1, 2)
+
+
+# 6. Список товаров берется из Redis, пока его не сбросит добавление товара
+@pytest.mark.asyncio
+async def test_products_list_is_cached_until_product_added():
+    from types import SimpleNamespace
+    import auth
+    from graphql_app.schema import schema, get_context
+    from services.product_service import GRAPHQL_PRODUCTS_CACHE_KEY
+
+    products = [{'id': 1, 'name': 'cached item', 'description': None, 'price': 5}]
+    fetches = []
+
+    class FakePool:
+        async def fetch(self, query, after_id, limit):
+            fetches.append((after_id, limit))
+            # Как Postgres: только колонки из SELECT
+            columns = query.split('SELECT ')[1].split(' FROM')[0].split(', ')
+            return [{c: p[c] for c in columns} for p in products if p['id'] > after_id][:limit]
+
+        async def fetchrow(self, query, name, description, price):
+            products.append({'id': 2, 'name': name, 'description': description, 'price': price})
+            return {'id': 2}
+
+    class FakePipeline:
+        def __init__(self, redis):
+            self.redis = redis
+            self.commands = []
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            pass
+
+        def hset(self, key, field, value):
+            self.commands.append(lambda: self.redis.data.setdefault(key, {}).__setitem__(field, value))
+
+        def expire(self, key, seconds):
+            self.commands.append(lambda: None)
+
+        async def execute(self):
+            self.redis.round_trips += 1
+            return [command() for command in self.commands]
+
+    class FakeRedis:
+        def __init__(self):
+            self.data = {}
+            self.round_trips = 0
+
+        async def hget(self, key, field):
+            self.round_trips += 1
+            return self.data.get(key, {}).get(field)
+
+        def pipeline(self, transaction=True):
+            assert transaction is False
+            return FakePipeline(self)
+
+        async def delete(self, *keys):
+            for key in keys:
+                self.data.pop(key, None)
+
+        async def exists(self, key):
+            # Проверка отзыва токена в мутациях
+            self.round_trips += 1
+            return int(key in self.data)
+
+    redis = FakeRedis()
+    token = auth.create_tokens({'sub': 'graphql_user'})['access_token']
+    request = SimpleNamespace(
+        app=SimpleNamespace(state=SimpleNamespace(pool=FakePool(), redis=redis)),
+        headers={'Authorization': f'Bearer {token}'},
+    )
+
+    async def run(query):
+        context = {**await get_context(request), 'request': request}
+        result = await schema.execute(query, context_value=context)
+        assert result.errors is None
+        return result.data
+
+    list_query = 'query { products { id name } }'
+    assert await run(list_query) == {'products': [{'id': '1', 'name': 'cached item'}]}
+    assert await run(list_query) == {'products': [{'id': '1', 'name': 'cached item'}]}
+    assert len(fetches) == 1
+    assert GRAPHQL_PRODUCTS_CACHE_KEY in redis.data
+    # Промах: HGET + один пакет HSET/EXPIRE; попадание: только HGET
+    assert redis.round_trips == 3
+
+    await run('mutation { addProduct(name: "fresh", price: 7) { id } }')
+    assert GRAPHQL_PRODUCTS_CACHE_KEY not in redis.data
+
+    assert [p['name'] for p in (await run(list_query))['products']] == ['cached item', 'fresh']
+    assert len(fetches) == 2
+
+    # Keyset-пагинация: страница после id=1, каждая страница — свое поле в том же hash
+    assert await run('query { products(first: 1, after: 1) { id } }') == {'products': [{'id': '2'}]}
+    assert fetches[-1] == (1, 1)
+    assert set(redis.data[GRAPHQL_PRODUCTS_CACHE_KEY]) == {'0:100:id,name', '1:1:id'}
+
+
+# 7. Список товаров выбирает из базы только запрошенные колонки (и всегда id)
+@pytest.mark.asyncio
+async def test_products_list_selects_only_requested_columns():
+    from types import SimpleNamespace
+    from graphql_app.schema import schema, get_context
+
+    queries = []
+
+    class FakePool:
+        async def fetch(self, query, after_id, limit):
+            queries.append(query)
+            return [{'id': 1, 'name': 'narrow', 'description': 'wide text', 'price': 9}]
+
+    request = SimpleNamespace(app=SimpleNamespace(state=SimpleNamespace(pool=FakePool(), redis=None)))
+    context = {**await get_context(request), 'request': request}
+
+    result = await schema.execute("""
+    query {
+        products { name ...Priced }
+    }
+    fragment Priced on ProductType { price }
+    """, context_value=context)
+    assert result.errors is None
+    assert result.data == {'products': [{'name': 'narrow', 'price': 9}]}
+
+    result = await schema.execute('query { products { description } }', context_value=context)
+    assert result.data == {'products': [{'description': 'wide text'}]}
+
+    assert queries == [
+        'SELECT id, name, price FROM products WHERE id > $1 ORDER BY id LIMIT $2',
+        'SELECT id, description FROM products WHERE id > $1 ORDER BY id LIMIT $2',
+    ]
+
+
+# 8. ProductType без __dict__ — только слоты под четыре поля
+def test_product_type_uses_slots():
+    from graphql_app.schema import ProductType
+
+    product = ProductType(id=1, name='slotted', description=None, price=3)
+    assert not hasattr(product, '__dict__')
+    assert (product.id, product.name, product.description, product.price) == (1, 'slotted', None, 3)
+
+
+# 9. addProducts добавляет всю пачку одним INSERT и сбрасывает кэш списка
+@pytest.mark.asyncio
+async def test_add_products_inserts_batch_in_one_query():
+    from types import SimpleNamespace
+    import auth
+    from graphql_app.schema import schema, get_context, PRODUCTS_BULK_INSERT_SQL
+    from services.product_service import GRAPHQL_PRODUCTS_CACHE_KEY
+
+    calls = []
+
+    class FakePool:
+        async def fetch(self, query, names, descriptions, prices):
+            calls.append((query, names, descriptions, prices))
+            return [{'id': 10 + i, 'name': n, 'description': d, 'price': p}
+                    for i, (n, d, p) in enumerate(zip(names, descriptions, prices))]
+
+    class FakeRedis:
+        def __init__(self):
+            self.deleted = []
+
+        async def delete(self, *keys):
+            self.deleted.extend(keys)
+
+        async def exists(self, key):
+            return 0
+
+    redis = FakeRedis()
+    token = auth.create_tokens({'sub': 'graphql_user'})['access_token']
+    request = SimpleNamespace(
+        app=SimpleNamespace(state=SimpleNamespace(pool=FakePool(), redis=redis)),
+        headers={'Authorization': f'Bearer {token}'},
+    )
+    context = {**await get_context(request), 'request': request}
+
+    result = await schema.execute("""
+    mutation {
+        addProducts(items: [{name: "a", price: 1}, {name: "b", price: 2, description: "second"}]) { id name description price }
+    }
+    """, context_value=context)
+
+    assert result.errors is None
+    assert result.data == {'addProducts': [
+        {'id': '10', 'name': 'a', 'description': None, 'price': 1},
+        {'id': '11', 'name': 'b', 'description': 'second', 'price': 2},
+    ]}
+    assert calls == [(PRODUCTS_BULK_INSERT_SQL, ['a', 'b'], [None, 'second'], [1, 2])]
+    assert redis.deleted == [GRAPHQL_PRODUCTS_CACHE_KEY]
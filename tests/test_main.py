@@ -18,6 +18,8 @@ def test_read_root(client: TestClient):
 
     # (Опционально) Проверяем, что нам вернулся именно HTML
     assert "text/html" in response.headers["content-type"]
+    # Главную страницу браузер кэширует так же, как файлы из /static
+    assert response.headers["cache-control"] == "public, max-age=3600"
 
 def test_not_found(client: TestClient):
     print("Starting test_not_found")
@@ -28,6 +30,17 @@ def test_not_found(client: TestClient):
     print(f"Response status: {response.status_code}")
     assert response.status_code == 404
 
+def test_unknown_paths_are_handled_by_api_router(client: TestClient):
+    """Статика не перехватывает пути API: без слэша — редирект, неизвестный путь — JSON 404."""
+    response = client.post('/products', json={}, follow_redirects=False)
+    assert response.status_code == status.HTTP_307_TEMPORARY_REDIRECT
+    assert response.headers['location'].endswith('/products/')
+
+    # Файлы из static/ доступны только по /static/...
+    response = client.get('/script.js')
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert response.json() == {'detail': 'Not Found'}
+
 def test_protected_without_token(client):
     response = client.get('/auth/protected')
     assert response.status_code == 403
@@ -73,4 +86,12 @@ def test_protected_with_invalid_token(client: TestClient):
     data = response_protected.json()
     assert "detail" in data
     # Например, если у тебя там "Could not validate credentials"
-    # assert data["detail"] == "Could not validate credentials"
\ No newline at end of file
+    # assert data["detail"] == "Could not validate credentials"
+
+def test_process_time_header_skips_static(client: TestClient):
+    """X-Process-Time есть у ответов API (в том числе ошибок) и отсутствует у статики."""
+    api_response = client.get('/auth/protected')
+    assert float(api_response.headers['X-Process-Time']) >= 0
+
+    assert 'X-Process-Time' not in client.get('/').headers
+    assert 'X-Process-Time' not in client.get('/static/script.js').headers
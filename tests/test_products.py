@@ -198,3 +198,14 @@ def test_update_others_product_forbidden(client: TestClient, auth_headers: dict)
 
     assert update_resp.status_code == status.HTTP_403_FORBIDDEN
 
+
+
+def test_product_json_keeps_decimal_price_and_unicode():
+    """Кэш и уведомления о товарах пишутся через orjson: NUMERIC-цена — число, кириллица — как есть."""
+    from decimal import Decimal
+    import orjson
+    from services.product_service import _dumps
+
+    product = {'id': 1, 'name': 'Чайник', 'price': Decimal('10.50'), 'owner_username': 'u'}
+    assert orjson.loads(_dumps([product])) == [{'id': 1, 'name': 'Чайник', 'price': 10.5, 'owner_username': 'u'}]
+    assert 'Чайник' in _dumps(product).decode()
@@ -1,5 +1,9 @@
+import asyncio
+from types import SimpleNamespace
 from fastapi.testclient import TestClient
-from auth import create_tokens
+from starlette import status
+from auth import create_tokens, decode_token, revoke_token
+from websocket import ConnectionManager, websocket_chat, websocket_notification, websocket_products
 
 # --- Тест 1: Успешное подключение к WebSocket ---
 def test_websocket_connect_success(client: TestClient):
@@ -9,7 +13,7 @@ def test_websocket_connect_success(client: TestClient):
     """
     # 1. Создаем валидный токен для тестового пользователя
     # Нам не нужно регистрировать его в БД, если мы подделаем токен,
-    # но код проверяет get_user_from_db, поэтому надо зарегистрировать.
+    # но код проверяет пользователя в БД, поэтому надо зарегистрировать.
 
     # Регистрируем пользователя через API (чтобы он попал в Mock DB)
     user_data = {"username": "ws_chat", "password": "strongpassword123"}
@@ -70,6 +74,108 @@ def test_websocket_user_not_found(client: TestClient):
             websocket.receive_text()
             assert False, "Соединение должно было закрыться"
     except Exception:
-        # Ожидаем разрыв соединения, так как get_user_from_db вернет None
+        # Ожидаем разрыв соединения, так как поиск пользователя вернет None
         pass
 
+
+
+# --- Тест 4: Повторное подключение не ходит в БД за пользователем ---
+def test_websocket_reconnect_uses_cached_user(client: TestClient, monkeypatch):
+    """Второе рукопожатие с тем же пользователем берет профиль из кэша, а не из БД."""
+    import auth
+
+    lookups = []
+    original_get_user_profile = auth.get_user_profile
+
+    async def counting_get_user_profile(pool, username):
+        lookups.append(username)
+        return await original_get_user_profile(pool, username)
+
+    monkeypatch.setattr(auth, "get_user_profile", counting_get_user_profile)
+
+    client.post('/auth/register', json={"username": "ws_again", "password": "strongpassword123"})
+    response = client.post('/auth/login', data={"username": "ws_again", "password": "strongpassword123"})
+    token = response.json()["access_token"]
+
+    for _ in range(2):
+        with client.websocket_connect(f"/ws/chat?token={token}") as websocket:
+            assert "ws_again" in websocket.receive_text()
+
+    assert lookups == ["ws_again"]
+
+
+# --- Тест 5: Рассылка идет всем сразу, упавшие соединения убираются ---
+async def test_broadcast_sends_concurrently_and_drops_dead_connections():
+    started = []
+    release = asyncio.Event()
+
+    class FakeSocket:
+        def __init__(self, fail=False):
+            self.fail = fail
+            self.received = []
+
+        async def accept(self):
+            pass
+
+        async def send_text(self, message):
+            started.append(self)
+            if self.fail:
+                raise RuntimeError("connection closed")
+            # Медленный клиент: отправка висит, пока тест ее не отпустит
+            await release.wait()
+            self.received.append(message)
+
+    manager = ConnectionManager()
+    slow_a, slow_b, dead = FakeSocket(), FakeSocket(), FakeSocket(fail=True)
+    await manager.connect(slow_a, "alice")
+    await manager.connect(slow_b, "bob")
+    await manager.connect(dead, "bob")
+
+    broadcast = asyncio.ensure_future(manager.broadcast("hello"))
+    for _ in range(10):
+        if len(started) == 3:
+            break
+        await asyncio.sleep(0)
+
+    # Все отправки начались, хотя ни одна медленная еще не закончилась: при поочередной
+    # рассылке вторая ждала бы первую и сюда бы не дошла
+    assert set(started) == {slow_a, slow_b, dead}
+    assert slow_a.received == slow_b.received == []
+    assert not broadcast.done()
+
+    release.set()
+    await broadcast
+    assert slow_a.received == slow_b.received == ["hello"]
+    assert manager.active_connections == {"alice": {slow_a}, "bob": {slow_b}}
+
+    await manager.send_personal_message("hi bob", "bob")
+    assert slow_b.received == ["hello", "hi bob"]
+
+
+# --- Тест 6: Отозванный токен не открывает WebSocket ---
+class FakeWebSocket:
+    """Рукопожатие без сервера: запоминает, приняли соединение или закрыли и с каким кодом."""
+
+    def __init__(self, redis):
+        self.app = SimpleNamespace(state=SimpleNamespace(pool=None, redis=redis))
+        self.accepted = False
+        self.close_code = None
+
+    async def accept(self):
+        self.accepted = True
+
+    async def close(self, code=1000, reason=None):
+        self.close_code = code
+
+
+async def test_websocket_rejects_revoked_token(fake_redis):
+    """Токен, отозванный через /auth/logout, не проходит ни на один WebSocket-эндпоинт."""
+    token = create_tokens({'sub': 'ws_logout'})['access_token']
+    payload = decode_token(token)
+    await revoke_token(fake_redis, payload['jti'], payload['exp'])
+
+    for handler in (websocket_notification, websocket_chat, websocket_products):
+        websocket = FakeWebSocket(fake_redis)
+        await handler(websocket, token)
+        assert websocket.close_code == status.WS_1008_POLICY_VIOLATION
+        assert not websocket.accepted
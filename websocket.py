@@ -1,9 +1,17 @@
 # WebSocket, WebSocketDisconnect — добавляет поддержку WebSocket-протокола и обработку разрыва соединения.
+import asyncio
+import logging
 from fastapi import WebSocket, WebSocketDisconnect, APIRouter, Query, status
 from typing import Optional
 import asyncpg
-from jose import jwt, JWTError
-from auth import SECRET_KEY, ALGORITHM, get_user_from_db
+from jwt import InvalidTokenError
+# Токены проверяем общей decode_access_token: подпись, срок, тип и отзыв через /auth/logout
+# в одном месте, чтобы ни один вход не пропустил проверку отзыва.
+# Пользователя ищем через тот же кэш профилей, что и get_current_user: повторные подключения
+# (переподключение после обрыва, несколько вкладок) не ходят в БД
+from auth import decode_access_token, get_user_profile_cached
+
+logger = logging.getLogger(__name__)
 
 # Создаем APIRouter. Все эндпоинты в этом файле будут привязаны к нему.
 router = APIRouter(
@@ -17,43 +25,57 @@ router = APIRouter(
 class ConnectionManager:  
     # Инициализирует объект класса при его создании.
     def __init__(self):
-        # ИЗМЕНЕНИЕ: Теперь храним словарь: { "username": [соединения] }
-        self.active_connections: dict[str, list[WebSocket]] = {} # Создаёт пустой список для хранения всех активных WebSocket-соединений. 
-        # Тип list[WebSocket] указывает, что список содержит объекты типа WebSocket.
+        # ИЗМЕНЕНИЕ: Теперь храним словарь: { "username": {соединения} }
+        # Множество, а не список: удаление соединения при разрыве — O(1), без поиска по списку.
+        self.active_connections: dict[str, set[WebSocket]] = {}
 
     # connect: Принимает соединение, добавляет его в список
     # Асинхронный метод для подключения нового клиента
     async def connect(self, websocket: WebSocket, username: str):
         # Принимает входящее WebSocket-соединение, устанавливая "рукопожатие" между клиентом и сервером.
         await websocket.accept()
-        if username not in self.active_connections:
-            self.active_connections[username] = []
-        # Добавляет новое соединение в список активных
-        self.active_connections[username].append(websocket)
+        # Добавляет новое соединение в множество активных
+        self.active_connections.setdefault(username, set()).add(websocket)
 
     # disconnect: Удаляет соединение при разрыве.
     def disconnect(self, websocket: WebSocket, username: str):
-        if username in self.active_connections:
-            if websocket in self.active_connections[username]:
-                self.active_connections[username].remove(websocket)
-            if not self.active_connections[username]:
+        connections = self.active_connections.get(username)
+        if connections is not None:
+            connections.discard(websocket)
+            if not connections:
                 del self.active_connections[username]
-           
+
+    async def _send_all(self, message: str, targets: list[tuple[str, WebSocket]]):
+        """
+        Отправляет сообщение всем адресатам одновременно: рассылка длится столько,
+        сколько самый медленный клиент, а не сумму их задержек.
+        Соединения, отправка в которые упала (клиент уже отключился), убираем из списка.
+        """
+        results = await asyncio.gather(
+            *(connection.send_text(message) for _, connection in targets),
+            return_exceptions=True,
+        )
+        for (username, connection), result in zip(targets, results):
+            if isinstance(result, Exception):
+                logger.debug("Не удалось отправить сообщение %s, отключаем: %s", username, result)
+                self.disconnect(connection, username)
 
     # broadcast: Асинхронный метод для отправки сообщения всем подключённым клиентам.
     async def broadcast(self, message: str):
-        # Проходим по всем значениям словаря (то есть по всем спискам соединений)
-        for connections_list in self.active_connections.values():
-            for connection in connections_list:
-                # Отправляет текстовое сообщение каждому клиенту асинхронно.
-                await connection.send_text(message)
+        # Снимок всех соединений: пока идет рассылка, клиенты могут подключаться и отключаться
+        targets = [
+            (username, connection)
+            for username, connections in self.active_connections.items()
+            for connection in connections
+        ]
+        await self._send_all(message, targets)
 
 
     # НОВЫЙ МЕТОД: Отправка лично юзеру
     async def send_personal_message(self, message: str, username: str):
-        if username in self.active_connections:
-            for connection in self.active_connections[username]:
-                await connection.send_text(message)
+        connections = self.active_connections.get(username)
+        if connections:
+            await self._send_all(message, [(username, connection) for connection in connections])
 
 
 # ConnectionManager управляет подключениями и рассылает сообщения
@@ -70,27 +92,24 @@ async def websocket_notification(
     token: str = Query(...)
 ):
     try:
-        # Достаем пул напрямую из состояния приложения
+        # Достаем пул и Redis напрямую из состояния приложения
         pool: asyncpg.Pool = websocket.app.state.pool
+        redis = getattr(websocket.app.state, 'redis', None)
 
         username: Optional[str] = None
 
         try:
-            # Шаг 1: Проверяем токен
-            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]) 
-            if payload.get('type') != 'access':
-                await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason='Invalid token type')
-                return
+            # Шаг 1: Проверяем токен (access, не истек и не отозван)
+            payload = await decode_access_token(token, redis)
             
             # Шаг 2: Проверяем пользователя
-            username = payload.get('sub')
-            # Мы закрываем соединение, если имя пользователя не найдено ИЛИ
-            # если функция get_user_from_db вернула None (т.е. not await...).
-            if not username or not await get_user_from_db(pool, username):
+            username = payload['sub']
+            # Мы закрываем соединение, если такого пользователя нет (get_user_profile_cached вернула None).
+            if await get_user_profile_cached(pool, username, redis) is None:
                 await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason='User not found')
                 return
             
-        except JWTError:
+        except InvalidTokenError:
             await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason='Invalid or expired token')
             return
         
@@ -124,23 +143,20 @@ async def websocket_chat(
 ):
     # ИСПРАВЛЕНО: Получаем пул напрямую из websocket
     pool: asyncpg.Pool = websocket.app.state.pool
+    redis = getattr(websocket.app.state, 'redis', None)
     """
     Эндпоинт для интерактивного чата.
     Клиент подключается, может отправлять и получать сообщения.
     """
     username: Optional[str] = None
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        if payload.get('type') != 'access':
-            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
-            return
-        
-        username = payload.get('sub')
-        if not username or not await get_user_from_db(pool, username):
+        payload = await decode_access_token(token, redis)
+        username = payload['sub']
+        if await get_user_profile_cached(pool, username, redis) is None:
             await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
             return
         
-    except JWTError:
+    except InvalidTokenError:
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
         return
     
@@ -169,26 +185,20 @@ async def websocket_products(websocket: WebSocket, token: str = Query(...) ):
     username: Optional[str] = None
     try:
         pool: asyncpg.Pool = websocket.app.state.pool
+        redis = getattr(websocket.app.state, 'redis', None)
 
-        # Шаг 1: Декодируем токен
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        
-        # Шаг 2: Проверяем тип токена (должен быть access)
-        if payload.get("type") != "access":
-            # Закрывает соединение с кодом ошибки 1008 (нарушение политики) и сообщением.
-            await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid token type")
-            # Прерывает выполнение функции при ошибке
-            return
+        # Шаг 1-2: Декодируем токен и проверяем, что это access токен и он не отозван
+        payload = await decode_access_token(token, redis)
 
-        username = payload.get("sub")
-        # Шаг 3: Проверяет, что username существует и пользователь найден в базе. Если нет, закрывает соединение.
-        if username is None or await get_user_from_db (pool, username) is None:
+        username = payload["sub"]
+        # Шаг 3: Проверяет, что пользователь найден в базе. Если нет, закрывает соединение.
+        if await get_user_profile_cached(pool, username, redis) is None:
             await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="User not found")
             return
         
-    # Ловит ошибки декодирования токена (например, истёкший или неверный токен).
-    except JWTError:
-        # Если токен невалидный или просрочен
+    # Ловит ошибки декодирования токена (например, истёкший, отозванный или refresh вместо access).
+    except InvalidTokenError:
+        # Если токен невалидный, просрочен или отозван
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid token")
         return
 